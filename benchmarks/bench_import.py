@@ -0,0 +1,78 @@
+"""
+Benchmark of the import time with python -X importtime, each target runs in a fresh interpreter, the best of repeats.
+
+The time is the cumulative time of the imports, excluding the interpreter startup ones. The storage only targets must
+not import spaCy, the run fails if any does, or if it is slower than --max-ms.
+
+$ python -m benchmarks.bench_import [--repeat 5] [--max-ms 300]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import typing
+from excelcy.utils import odict
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'data')
+CONVERT = 'from excelcy.storage import Storage; s = Storage(); s.load(file_path=%r); s.save(file_path=%r)' % (
+    os.path.join(DATA_PATH, 'test_data_01.xlsx'), os.path.join(tempfile.gettempdir(), 'bench_import.yml'))
+
+# name, code and whether it may import spaCy
+TARGETS = [
+    ('import excelcy', 'import excelcy', False),
+    ('import excelcy.storage', 'import excelcy.storage', False),
+    ('import excelcy.cli', 'import excelcy.cli', False),
+    ('ExcelCy()', 'from excelcy import ExcelCy; ExcelCy()', False),
+    ('convert xlsx to yml', CONVERT, False),
+    ('import excelcy.pipe', 'import excelcy.pipe', True),
+    ('import spacy', 'import spacy', True),
+]
+
+
+def import_times(code: str) -> typing.Tuple[odict, set]:
+    """
+    Run the code with -X importtime
+    :return: Cumulative microseconds of the top level imports by module name, and all the modules imported
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    times, modules = odict(), set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.add(name.strip())
+        # the nested imports are indented, they are in the cumulative of the top level one
+        if not name.startswith('  '):
+            times[name.strip()] = int(cumulative)
+    return times, modules
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench_import',
+                                     description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per target, the best is taken')
+    parser.add_argument('--max-ms', type=float, help='Maximum import time of the targets without spaCy')
+    opts = parser.parse_args(argv)
+
+    startup = set(import_times(code='pass')[0])
+    failures = []
+    print('%-24s %10s %8s' % ('target', 'ms', 'spacy'))
+    for name, code, allow_spacy in TARGETS:
+        best, has_spacy = None, False
+        for _ in range(opts.repeat):
+            times, modules = import_times(code=code)
+            # e.g. import excelcy.pipe imports spaCy nested
+            has_spacy = has_spacy or any(module.split('.')[0] == 'spacy' for module in modules)
+            total = sum(us for module, us in times.items() if module not in startup) / 1000
+            best = min(best or float('inf'), total)
+        if not allow_spacy and (has_spacy or (opts.max_ms and best > opts.max_ms)):
+            failures.append(name)
+        print('%-24s %10.1f %8s%s' % (name, best, 'yes' if has_spacy else 'no',
+                                      '  REGRESSION' if name in failures else ''))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
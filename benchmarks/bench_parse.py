@@ -0,0 +1,56 @@
+"""
+Benchmark of Storage.parse on a train sheet with 100k rows (by default), peak RSS and wall time.
+
+Compares the parse before, which deep copied the data first, against the parse now.
+Each mode runs in its own process, so the peak RSS is not shared.
+
+$ python -m benchmarks.bench_parse [n_train]
+"""
+import copy
+import resource
+import subprocess
+import sys
+import time
+from collections import OrderedDict as odict
+from excelcy.storage import Storage
+
+
+def build(n_train: int, n_gold_per_train: int = 2) -> odict:
+    train_items = odict()
+    for i in range(n_train):
+        gold_items = odict()
+        for j in range(n_gold_per_train):
+            idx = '%s.%s' % (i + 1, j + 1)
+            gold_items[idx] = odict([('idx', idx), ('subtext', 'Uber'), ('offset', '0,4'), ('entity', 'ORG')])
+        train_items[str(i + 1)] = odict([
+            ('idx', str(i + 1)), ('text', 'Uber blew through $1 million a week %s' % i), ('items', gold_items)
+        ])
+    return odict([
+        ('config', odict(nlp_base='en_core_web_sm')),
+        ('phase', odict(items=odict([('1', odict([('idx', '1'), ('fn', 'train'), ('args', odict())]))]))),
+        ('train', odict(items=train_items))
+    ])
+
+
+def run(mode: str, n_train: int):
+    data = build(n_train=n_train)
+    start = time.perf_counter()
+    if mode == 'deepcopy':
+        data = copy.deepcopy(data)
+    Storage().parse(data=data)
+    wall_time = time.perf_counter() - start
+    # ru_maxrss is in KB on linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print('%-8s n=%d parse=%.3fs peak_rss=%.0fMB' % (mode, n_train, wall_time, peak_rss))
+
+
+def main(n_train: int = 100000):
+    for mode in ['deepcopy', 'direct']:
+        subprocess.check_call([sys.executable, '-m', 'benchmarks.bench_parse', str(n_train), mode])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        run(mode=sys.argv[2], n_train=int(sys.argv[1]))
+    else:
+        main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,90 @@
+"""
+Benchmark of the phrase backends of MatcherPipe, spaCy PhraseMatcher against PhraseTrie, on the same phrases and docs.
+
+M phrases of 1-3 tokens are added for K entities, then N sentences with the phrases are matched. Each backend runs in
+a fresh interpreter, so the peak memory growth is its own. The matches of the backends are compared as well.
+
+$ python -m benchmarks.bench_phrase [--phrases 100000] [--sentences 20000]
+"""
+import argparse
+import json
+import random
+import subprocess
+import sys
+import time
+from excelcy import utils
+
+WORDS = ['the', 'company', 'expands', 'to', 'new', 'markets', 'while', 'revenue', 'grows', 'in', 'quarter', 'after',
+         'launch', 'of', 'service', 'with', 'partners', 'across', 'region', 'and', 'reports', 'strong', 'results']
+
+
+def make_data(n_phrases: int, n_sentences: int, seed: int = 0):
+    rnd = random.Random(seed)
+    phrases = [' '.join(['Name%s' % i, 'Corp', 'Group'][:1 + i % 3]) for i in range(n_phrases)]
+    sentences = []
+    for _ in range(n_sentences):
+        words = rnd.sample(WORDS, 10)
+        for _ in range(2):
+            words.insert(rnd.randint(0, len(words)), rnd.choice(phrases))
+        sentences.append(' '.join(words) + '.')
+    return phrases, sentences
+
+
+def run(backend: str, n_phrases: int, n_sentences: int, n_entities: int) -> dict:
+    import spacy
+    from excelcy.pipe import MatcherPipe
+    nlp = spacy.blank('en')
+    phrases, sentences = make_data(n_phrases=n_phrases, n_sentences=n_sentences)
+    docs = list(nlp.tokenizer.pipe(sentences))
+
+    rss = utils.peak_rss()
+    start = time.perf_counter()
+    pipe = MatcherPipe(nlp=nlp, phrase_backend=backend)
+    for entity in range(n_entities):
+        pipe.add_phrases(values=phrases[entity::n_entities], entity='ENT%s' % entity)
+    # the trie is turned into arrays on the first match
+    pipe.phrase_matcher(nlp.make_doc('warm up'))
+    build = time.perf_counter() - start
+    rss_build = utils.peak_rss() - rss if rss is not None else None
+
+    start = time.perf_counter()
+    matches = [sorted(pipe.phrase_matcher(doc)) for doc in docs]
+    match = time.perf_counter() - start
+    start = time.perf_counter()
+    pipe_matches = [sorted(doc_matches) for _, doc_matches in pipe.phrase_matcher.pipe(docs, return_matches=True)]
+    match_pipe = time.perf_counter() - start
+    assert pipe_matches == matches
+    return {'build': build, 'match': match, 'match_pipe': match_pipe, 'rss_build': rss_build, 'matches': matches}
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench_phrase',
+                                     description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--phrases', type=int, default=100000, help='M phrases')
+    parser.add_argument('--sentences', type=int, default=20000, help='N sentences')
+    parser.add_argument('--entities', type=int, default=5, help='K entities')
+    parser.add_argument('--backend', help='Run only this backend and print the result as JSON')
+    opts = parser.parse_args(argv)
+    if opts.backend:
+        print(json.dumps(run(backend=opts.backend, n_phrases=opts.phrases, n_sentences=opts.sentences,
+                             n_entities=opts.entities)))
+        return 0
+
+    results = {}
+    for backend in ['matcher', 'trie']:
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_phrase', '--backend', backend,
+                                 '--phrases', str(opts.phrases), '--sentences', str(opts.sentences),
+                                 '--entities', str(opts.entities)], stdout=subprocess.PIPE, check=True).stdout
+        results[backend] = json.loads(output.decode('utf-8').strip().split('\n')[-1])
+    print('%-8s %10s %14s %14s %14s' % ('backend', 'build s', 'call sents/s', 'pipe sents/s', 'build rss MB'))
+    for backend, result in results.items():
+        print('%-8s %10.3f %14.0f %14.0f %14s' % (
+            backend, result['build'], opts.sentences / result['match'], opts.sentences / result['match_pipe'],
+            '%.1f' % result['rss_build'] if result['rss_build'] is not None else '-'))
+    same = results['matcher']['matches'] == results['trie']['matches']
+    print('matches are %s' % ('the same' if same else 'DIFFERENT'))
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+Micro-benchmark of Registry attribute access on a storage with 1M gold (by default).
+
+Compares the slotted Gold against the legacy access where every read goes through overridden __getattribute__.
+
+$ python -m benchmarks.bench_registry [n_gold]
+"""
+import sys
+import time
+import attr
+from excelcy.storage import BaseItemRegistry, Gold, Trains
+
+
+@attr.s()
+class LegacyGold(BaseItemRegistry):
+    subtext = attr.ib(default=None)  # type: str
+    offset = attr.ib(default=None)  # type: str
+    entity = attr.ib(default=None)  # type: str
+
+    def __getattribute__(self, item):
+        # the access before, try/except for every attribute read
+        try:
+            return super(LegacyGold, self).__getattribute__(item)
+        except AttributeError:
+            return None
+
+
+def build(gold_cls, n_gold: int, n_gold_per_train: int = 5) -> Trains:
+    trains = Trains()
+    train = None
+    for i in range(n_gold):
+        if i % n_gold_per_train == 0:
+            train = trains.add(text='Uber blew through $1 million a week')
+        train.add_item(item=gold_cls(subtext='Uber', offset='0,4', entity='ORG'))
+    return trains
+
+
+def read(trains: Trains) -> float:
+    start = time.perf_counter()
+    for _, train in trains.items.items():
+        for _, gold in train.items.items():
+            gold.subtext, gold.offset, gold.entity, gold.idx, gold.missing
+    return time.perf_counter() - start
+
+
+def main(n_gold: int = 1000000):
+    for name, gold_cls in [('legacy', LegacyGold), ('slots', Gold)]:
+        start = time.perf_counter()
+        trains = build(gold_cls=gold_cls, n_gold=n_gold)
+        build_time = time.perf_counter() - start
+        read_time = read(trains=trains)
+        print('%-8s build=%.3fs read=%.3fs (%.0f ns/attr)' % (
+            name, build_time, read_time, read_time / n_gold / 5 * 1e9))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,31 @@
+"""
+Benchmark of Storage.save/load for each format on 20k train (by default), file size and wall time.
+
+$ python -m benchmarks.bench_storage [n_train]
+"""
+import os
+import sys
+import tempfile
+import time
+from excelcy.storage import Storage
+from benchmarks.bench_parse import build
+
+
+def main(n_train: int = 20000):
+    storage = Storage()
+    storage.parse(data=build(n_train=n_train))
+    for ext in ['xlsx', 'yml', 'msgpack']:
+        file_path = os.path.join(tempfile.gettempdir(), 'bench_storage.%s' % ext)
+        start = time.perf_counter()
+        storage.save(file_path=file_path)
+        save_time = time.perf_counter() - start
+        start = time.perf_counter()
+        Storage().load(file_path=file_path)
+        load_time = time.perf_counter() - start
+        size = os.path.getsize(file_path) / 1024 / 1024
+        print('%-8s n=%d size=%.1fMB save=%.3fs load=%.3fs' % (ext, n_train, size, save_time, load_time))
+        os.remove(file_path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
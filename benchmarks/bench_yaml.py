@@ -0,0 +1,45 @@
+"""
+Benchmark of YAML storage load/save, the data/api.yml structure scaled up to 20k train (by default).
+
+Compares the pure-Python loader/dumper against the C LibYAML ones used by utils.yaml_load/yaml_save.
+
+$ python -m benchmarks.bench_yaml [n_train]
+"""
+import os
+import sys
+import tempfile
+import time
+import yaml
+from excelcy import utils
+from benchmarks.bench_parse import build
+
+
+def python_load(file_path: str):
+    with open(file_path, 'r') as f:
+        return yaml.load(f, utils._yaml_loader(base=yaml.SafeLoader))
+
+
+def python_save(data, file_path: str):
+    with open(file_path, 'w') as f:
+        yaml.dump(data, f, Dumper=utils._yaml_dumper(base=yaml.SafeDumper), default_flow_style=False)
+
+
+def main(n_train: int = 20000):
+    if not yaml.__with_libyaml__:
+        print('LibYAML is not available, both run on the pure-Python')
+    data = build(n_train=n_train)
+    file_path = os.path.join(tempfile.gettempdir(), 'bench_yaml.yml')
+    for name, load, save in [('python', python_load, python_save), ('libyaml', utils.yaml_load, utils.yaml_save)]:
+        start = time.perf_counter()
+        save(data, file_path=file_path)
+        save_time = time.perf_counter() - start
+        start = time.perf_counter()
+        load(file_path=file_path)
+        load_time = time.perf_counter() - start
+        size = os.path.getsize(file_path) / 1024 / 1024
+        print('%-8s n=%d size=%.1fMB save=%.3fs load=%.3fs' % (name, n_train, size, save_time, load_time))
+    os.remove(file_path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,164 @@
+"""
+Benchmark suite of the phases and storage formats on synthetic data, scaled from the tests/data workbooks:
+N sentences, M phrase patterns, R regex patterns and K entities. It runs offline with a blank spaCy model.
+
+Each phase is measured by the phase stats of ExcelCy.run (throughput of items and peak memory growth), each
+storage format by save/load throughput of train rows and file size. The results can be saved as baseline, and
+compared to it later, the run fails if any throughput is slower than the baseline by the tolerance.
+
+$ python -m benchmarks.suite --save-baseline benchmarks/baseline.json
+$ python -m benchmarks.suite --baseline benchmarks/baseline.json --tolerance 1.25
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import warnings
+import spacy
+from excelcy import ExcelCy, utils
+from excelcy.storage import Config, Storage
+from excelcy.utils import odict
+
+# the blank model has no lexeme normalization table, it is not relevant to the benchmark
+warnings.filterwarnings('ignore', message=r'\[W03[34]\]')
+
+WORDS = ['the', 'company', 'expands', 'to', 'new', 'markets', 'while', 'revenue', 'grows', 'in', 'quarter', 'after',
+         'launch', 'of', 'service', 'with', 'partners', 'across', 'region', 'and', 'reports', 'strong', 'results']
+
+
+def make_nlp():
+    # blank model, so no model package nor network is needed
+    nlp = spacy.blank('en')
+    nlp.add_pipe(nlp.create_pipe('sentencizer'))
+    nlp.add_pipe(nlp.create_pipe('ner'))
+    # the untrained ner must be initialized before it is used in discover and prepare
+    nlp.begin_training()
+    return nlp
+
+
+def make_excelcy(n_sentences: int, n_patterns: int, n_regexes: int, n_entities: int, iterations: int,
+                 phrase_backend: str = 'matcher', seed: int = 0) -> ExcelCy:
+    """
+    Synthetic storage with one text source of N sentences, M phrase and R regex patterns of K entities
+    """
+    rnd = random.Random(seed)
+    entities = ['ENT%s' % i for i in range(n_entities)]
+    phrases = ['Name%s Corp' % i for i in range(n_patterns)]
+    excelcy = ExcelCy()
+    storage = excelcy.storage
+    storage.nlp_obj = make_nlp()
+    storage.config = Config(nlp_base='en', train_iteration=iterations, train_drop=0.2, train_batch_size=4,
+                            train_batch_size_end=32, prepare_phrase_backend=phrase_backend)
+    for fn in ['discover', 'prepare', 'train', 'retest']:
+        storage.phase.add(fn=fn)
+    for i, phrase in enumerate(phrases):
+        storage.prepare.add(kind='phrase', value=phrase, entity=entities[i % n_entities])
+    for i in range(n_regexes):
+        storage.prepare.add(kind='regex', value=r'\bCODE%s-\d+\b' % i, entity=entities[i % n_entities])
+
+    sentences = []
+    for i in range(n_sentences):
+        words = rnd.sample(WORDS, 8)
+        if phrases:
+            words.insert(rnd.randint(0, len(words)), rnd.choice(phrases))
+        if n_regexes:
+            words.insert(rnd.randint(0, len(words)), 'CODE%s-%s' % (rnd.randrange(n_regexes), rnd.randrange(1000)))
+        sentences.append(' '.join(words).capitalize() + '.')
+    storage.source.add(kind='text', value=' '.join(sentences))
+    return excelcy
+
+
+def bench_phases(excelcy: ExcelCy) -> odict:
+    results = odict()
+    excelcy.run()
+    for stat in excelcy.phase_stats:
+        results['phase.%s' % stat['fn']] = odict([
+            ('seconds', stat['seconds']), ('items', stat['items']),
+            ('items_per_sec', stat['items'] / stat['seconds'] if stat['seconds'] else 0.0),
+            ('peak_rss_delta_mb', stat['peak_rss_delta_mb'])
+        ])
+    return results
+
+
+def bench_storage(storage: Storage, repeat: int = 3) -> odict:
+    results = odict()
+    rows = len(list(storage.train.iter_texts()))
+    for ext in ['xlsx', 'yml', 'msgpack']:
+        file_path = os.path.join(tempfile.gettempdir(), 'bench_suite.%s' % ext)
+        for name in ['save', 'load']:
+            rss = utils.peak_rss()
+            # the best of the repeats, the fast formats are noisy otherwise
+            seconds = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                if name == 'save':
+                    storage.save(file_path=file_path, kind=['source', 'prepare', 'train', 'config'])
+                else:
+                    Storage().load(file_path=file_path)
+                seconds = min(seconds or float('inf'), time.perf_counter() - start)
+            results['storage.%s.%s' % (ext, name)] = odict([
+                ('seconds', seconds), ('items', rows), ('items_per_sec', rows / seconds if seconds else 0.0),
+                ('peak_rss_delta_mb', utils.peak_rss() - rss if rss is not None else None),
+                ('size_mb', os.path.getsize(file_path) / 1024 / 1024)
+            ])
+        os.remove(file_path)
+    return results
+
+
+def compare(results: odict, baseline: odict, tolerance: float) -> list:
+    """
+    Print the results against the baseline results
+    :return: Names of the regressions, throughput slower than baseline divided by tolerance
+    """
+    regressions = []
+    print('%-24s %12s %12s %8s %10s' % ('benchmark', 'items/s', 'baseline', 'ratio', 'rss MB'))
+    for name, result in results.items():
+        base = baseline.get(name, {}).get('items_per_sec')
+        ratio = result['items_per_sec'] / base if base else None
+        regressed = ratio is not None and ratio < 1 / tolerance
+        if regressed:
+            regressions.append(name)
+        print('%-24s %12.1f %12s %8s %10s%s' % (
+            name, result['items_per_sec'], '%.1f' % base if base else '-', '%.2f' % ratio if ratio else '-',
+            '%.1f' % result['peak_rss_delta_mb'] if result['peak_rss_delta_mb'] is not None else '-',
+            '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sentences', type=int, default=2000, help='N sentences')
+    parser.add_argument('--patterns', type=int, default=500, help='M phrase patterns')
+    parser.add_argument('--regexes', type=int, default=20, help='R regex patterns')
+    parser.add_argument('--entities', type=int, default=5, help='K entities')
+    parser.add_argument('--iterations', type=int, default=2, help='Train iterations')
+    parser.add_argument('--phrase-backend', default='matcher', help='Config prepare_phrase_backend')
+    parser.add_argument('--baseline', help='Compare with the baseline JSON file')
+    parser.add_argument('--save-baseline', help='Save the results as baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='Allowed slowdown against the baseline')
+    parser.add_argument('--repeat', type=int, default=3, help='Repeat storage save/load, the best is taken')
+    opts = parser.parse_args(argv)
+    params = odict([('sentences', opts.sentences), ('patterns', opts.patterns), ('regexes', opts.regexes),
+                    ('entities', opts.entities), ('iterations', opts.iterations),
+                    ('phrase_backend', opts.phrase_backend)])
+
+    excelcy = make_excelcy(n_sentences=opts.sentences, n_patterns=opts.patterns, n_regexes=opts.regexes,
+                           n_entities=opts.entities, iterations=opts.iterations, phrase_backend=opts.phrase_backend)
+    results = bench_phases(excelcy=excelcy)
+    results.update(bench_storage(storage=excelcy.storage, repeat=opts.repeat))
+
+    baseline = utils.json_load(file_path=opts.baseline) if opts.baseline else {}
+    if baseline and baseline.get('params') != params:
+        # the throughput is not comparable in different scale
+        print('Baseline params %s differ from %s, it is not compared' % (baseline.get('params'), dict(params)))
+        baseline = {}
+    regressions = compare(results=results, baseline=baseline.get('results', {}), tolerance=opts.tolerance)
+    if opts.save_baseline:
+        utils.json_save(data=odict([('params', params), ('results', results)]), file_path=opts.save_baseline)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
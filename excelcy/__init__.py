@@ -1,5 +1,15 @@
-from excelcy.excelcy import ExcelCy
+import sys
 
 
 __version__ = '0.3.3'
 __all__ = ['ExcelCy']
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name: str):
+        # ExcelCy is imported on first access, so the storage only usage does not import spaCy
+        if name == 'ExcelCy':
+            from excelcy.excelcy import ExcelCy
+            return ExcelCy
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+else:
+    from excelcy.excelcy import ExcelCy
@@ -0,0 +1,248 @@
+import copy
+import hashlib
+import os
+import threading
+import typing
+from excelcy import utils
+from excelcy.utils import odict
+
+if typing.TYPE_CHECKING:
+    from spacy.language import Language
+
+# entity annotation as (start_char, end_char, label)
+Ent = typing.Tuple[int, int, str]
+
+
+def load_nlp(name: str) -> 'Language':
+    """
+    spacy.load, spaCy is imported only when the model is needed
+    :param name: Model package name, shortcut or path
+    """
+    import spacy
+    # registers the excelcy-matcher factory, to restore the model saved with it
+    import excelcy.pipe  # noqa: F401
+    return spacy.load(name)
+
+
+class PrepareCache(object):
+    # hash of the weights by id of the pipe, with the pipe, it is process-wide as the pipes of nlp_cache are shared
+    weights = odict()  # type: typing.Dict[int, tuple]
+    weights_size = 64
+
+    def __init__(self, file_path: str):
+        """
+        Cache of the prepare annotations, keyed by hash of the text and fingerprint of the nlp model with its patterns.
+        Only the entries used since it is opened are saved, so the stale entries of other models are dropped.
+
+        :param file_path: Cache file path, in msgpack
+        """
+        self.file_path = file_path
+        self.fingerprint = b''
+        self.hits, self.misses = 0, 0
+        self.entries = {}  # type: typing.Dict[bytes, typing.List[Ent]]
+        self.used = {}  # type: typing.Dict[bytes, typing.List[Ent]]
+        if os.path.exists(file_path):
+            self.entries = utils.msgpack_load(file_path=file_path)
+
+    @classmethod
+    def make_fingerprint(cls, nlp) -> bytes:
+        """
+        Fingerprint of the pipeline, of the model meta, the pipe names, the weights and MatcherPipe patterns.
+        The weights of the tokenizer and the pipes are hashed once per object, as the patterns change with every
+        prepare, only they are hashed each time. A pipe trained since must be passed to forget.
+        The vocab is excluded as it grows with every text processed.
+
+        :param nlp: The nlp object
+        """
+        from excelcy.pipe import MatcherPipe
+        meta = nlp.meta
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr([meta.get('lang'), meta.get('name'), meta.get('version'), nlp.pipe_names]).encode('utf-8'))
+        for pipe in [nlp.tokenizer] + [pipe for _, pipe in nlp.pipeline]:
+            if isinstance(pipe, MatcherPipe):
+                digest.update(pipe.to_bytes())
+                continue
+            entry = cls.weights.pop(id(pipe), None)
+            if entry is None or entry[0] is not pipe:
+                data = pipe.to_bytes(exclude=['vocab']) if hasattr(pipe, 'to_bytes') else b''
+                entry = (pipe, hashlib.blake2b(data, digest_size=16).digest())
+            cls.weights[id(pipe)] = entry
+            while len(cls.weights) > cls.weights_size:
+                cls.weights.popitem(last=False)
+            digest.update(entry[1])
+        return digest.digest()
+
+    @classmethod
+    def forget(cls, pipe):
+        """
+        Hash the weights of the pipe again in the next make_fingerprint, e.g. after it is trained
+        :param pipe: The pipe object
+        """
+        cls.weights.pop(id(pipe), None)
+
+    def key(self, text: str) -> bytes:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16, key=self.fingerprint).digest()
+
+    def get(self, text: str) -> typing.Optional[typing.List[Ent]]:
+        key = self.key(text=text)
+        ents = self.used.get(key, self.entries.get(key))
+        if ents is None:
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        self.used[key] = ents
+        return ents
+
+    def set(self, text: str, ents: typing.List[Ent]):
+        self.used[self.key(text=text)] = [list(ent) for ent in ents]
+
+    def save(self):
+        utils.msgpack_save(file_path=self.file_path, data=self.used)
+
+
+class TrainCache(object):
+    def __init__(self, file_path: str = None):
+        """
+        Cache of the tokenized train texts with their resolved gold offsets, keyed by the text and golds.
+        The docs are saved as DocBin, so retrain on the same corpus does not tokenize again. The entries of other
+        tokenizer are dropped, and as PrepareCache, only the entries used since it is opened are saved.
+
+        :param file_path: Cache file path, in msgpack, None to keep in memory only
+        """
+        self.file_path = file_path
+        self.fingerprint = b''
+        self.hits, self.misses = 0, 0
+        self.entries = {}  # type: typing.Dict[tuple, tuple]
+        self.used = odict()  # type: typing.Dict[tuple, None]
+
+    @staticmethod
+    def make_fingerprint(nlp) -> bytes:
+        return hashlib.blake2b(nlp.tokenizer.to_bytes(exclude=['vocab']), digest_size=16).digest()
+
+    def open(self, nlp):
+        """
+        Open the cache for the nlp tokenizer, the file is loaded the first time or after the tokenizer is changed
+        :param nlp: The nlp object
+        """
+        fingerprint = self.make_fingerprint(nlp=nlp)
+        if fingerprint != self.fingerprint:
+            self.fingerprint, self.entries = fingerprint, {}
+            if self.file_path and os.path.exists(self.file_path):
+                data = utils.msgpack_load(file_path=self.file_path)
+                if data['fingerprint'] == fingerprint:
+                    from spacy.tokens import DocBin
+                    docs = DocBin().from_bytes(data['docs']).get_docs(nlp.vocab)
+                    for doc, golds, ents, issues in zip(docs, data['golds'], data['ents'], data['issues']):
+                        key = (doc.text, tuple(tuple(gold) for gold in golds))
+                        self.entries[key] = (doc, [tuple(ent) for ent in ents], issues)
+        self.used = odict()
+        return self
+
+    def get(self, key: tuple) -> typing.Optional[tuple]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        self.used[key] = None
+        return entry
+
+    def set(self, key: tuple, entry: tuple):
+        self.entries[key] = entry
+        self.used[key] = None
+
+    def save(self):
+        from spacy.tokens import DocBin
+        docs = DocBin(attrs=['ORTH'])
+        data = odict([('fingerprint', self.fingerprint), ('golds', []), ('ents', []), ('issues', [])])
+        for key in self.used:
+            doc, ents, issues = self.entries[key]
+            docs.add(doc)
+            data['golds'].append(key[1])
+            data['ents'].append(ents)
+            data['issues'].append(issues)
+        data['docs'] = docs.to_bytes()
+        utils.msgpack_save(file_path=self.file_path, data=data)
+
+
+class NLPCache(object):
+    def __init__(self, maxsize: int = 4):
+        """
+        Process-wide cache of the loaded nlp models, the least recently used model is dropped once it is full.
+        The model from path is keyed with its meta.json modified time, so the model saved again is loaded again.
+
+        :param maxsize: Number of models to keep, 0 to disable the cache
+        """
+        self.maxsize = maxsize
+        self.items = odict()  # type: typing.Dict[tuple, 'Language']
+        self.hits, self.misses = 0, 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(name: str) -> tuple:
+        if isinstance(name, str) and os.path.isdir(name):
+            meta_path = os.path.join(name, 'meta.json')
+            return os.path.abspath(name), os.stat(meta_path).st_mtime_ns if os.path.exists(meta_path) else None
+        return name, None
+
+    @staticmethod
+    def copy(nlp: 'Language') -> 'Language':
+        """
+        Cheap copy of the nlp, it has its own pipeline to add, remove or replace pipes. The pipes and vocab are shared,
+        replace the pipe with its own copy (see own_pipe) before it is mutated, e.g. trained.
+
+        The vocab is not copied, as the pipes refer to it. The strings and lexemes added by a run, e.g. the entity
+        labels of train or the words of prepare, stay in the vocab of the cached model, so the later copies and the
+        models saved from them have them too. The weights and labels of the pipes are not shared once owned. Set env
+        EXCELCY_NLP_CACHE_SIZE=0 for a fresh vocab per run.
+
+        :param nlp: The nlp object
+        """
+        new_nlp = copy.copy(nlp)
+        new_nlp.pipeline = list(nlp.pipeline)
+        new_nlp._meta = copy.deepcopy(nlp._meta)
+        return new_nlp
+
+    @staticmethod
+    def own_pipe(nlp: 'Language', name: str):
+        """
+        Replace the shared pipe with its own copy in the nlp pipeline
+        :param nlp: The nlp object from copy
+        :param name: The pipe name
+        """
+        pipe = nlp.get_pipe(name)
+        # MatcherPipe has no cfg, its patterns are in the bytes
+        new_pipe = nlp.create_pipe(name, config=getattr(pipe, 'cfg', None) or {})
+        new_pipe.from_bytes(pipe.to_bytes(exclude=['vocab']), exclude=['vocab'])
+        nlp.replace_pipe(name, new_pipe)
+        return new_pipe
+
+    def load(self, name: str, copy: bool = False) -> 'Language':
+        """
+        Load the model from the cache, or spacy.load it and add into the cache
+        :param name: Model package name, shortcut or path
+        :param copy: Return a cheap copy which pipes can be added or removed, otherwise the cached one
+        """
+        key = self.make_key(name=name)
+        with self._lock:
+            nlp = self.items.pop(key, None)
+            if nlp is None:
+                nlp = load_nlp(name=name)
+                self.misses = self.misses + 1
+                # the same model saved before is stale
+                for stale_key in [item_key for item_key in self.items if item_key[0] == key[0]]:
+                    del self.items[stale_key]
+            else:
+                self.hits = self.hits + 1
+            if self.maxsize > 0:
+                self.items[key] = nlp
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+        return self.copy(nlp=nlp) if copy else nlp
+
+    def clear(self):
+        with self._lock:
+            self.items.clear()
+
+
+nlp_cache = NLPCache(maxsize=int(os.environ.get('EXCELCY_NLP_CACHE_SIZE', 4)))
@@ -1,14 +1,126 @@
+import argparse
+import functools
+import glob
+import multiprocessing
+import os
 import sys
+import time
+import traceback
+import typing
 
-from excelcy import ExcelCy
+from excelcy import ExcelCy, utils
+from excelcy.utils import odict
+
+
+def execute(file_path: str, report: bool = False, profile: bool = False, resume: bool = False,
+            excelcy: ExcelCy = None) -> ExcelCy:
+    """
+    Same as ExcelCy.execute, the flags turn on config phase_report, phase_profile and checkpoint_resume
+    :param file_path: Storage file path
+    :param report: Save the phase report next to the storage file
+    :param profile: Save cProfile of each phase next to the storage file, it implies report
+    :param resume: Resume from the checkpoint in config checkpoint_path
+    :param excelcy: The instance to execute, new instance if not given
+    """
+    excelcy = excelcy or ExcelCy()
+    excelcy.load(file_path=file_path)
+    config = excelcy.storage.config
+    config.phase_report = report or profile or config.phase_report
+    config.phase_profile = profile or config.phase_profile
+    config.checkpoint_resume = resume or config.checkpoint_resume
+    return excelcy.run()
+
+
+def batch_execute(file_path: str, report: bool = False, profile: bool = False, resume: bool = False) -> dict:
+    """
+    Execute one storage file, the failure is recorded rather than raised
+    :param file_path: Storage file path
+    :param report: See execute
+    :param profile: See execute
+    :param resume: See execute
+    :return: Summary with the phase timings and the error if any
+    """
+    summary = odict([('file_path', file_path), ('ok', False), ('seconds', 0.0), ('error', None), ('phases', [])])
+    excelcy = ExcelCy()
+    start = time.time()
+    try:
+        execute(file_path=file_path, report=report, profile=profile, resume=resume, excelcy=excelcy)
+        summary['ok'] = True
+    except Exception as e:
+        summary['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+        summary['traceback'] = traceback.format_exc()
+    summary['seconds'] = time.time() - start
+    summary['phases'] = excelcy.phase_stats
+    return summary
+
+
+def batch_files(patterns: typing.List[str]) -> typing.List[str]:
+    # expand the globs, the files are kept in the given order without duplicates
+    file_paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        file_paths.extend([file_path for file_path in matches if file_path not in file_paths])
+    return file_paths
+
+
+def batch(file_paths: typing.List[str], workers: int = 1, preload: typing.List[str] = None, report: bool = False,
+          profile: bool = False, resume: bool = False) -> typing.List[dict]:
+    """
+    Execute the storage files in process pool, the models to preload are loaded into the model cache before the
+    workers are forked, so they are shared copy-on-write rather than loaded by each worker.
+
+    :param file_paths: Storage file paths
+    :param workers: Number of worker processes, 1 to execute in this process
+    :param preload: Model names to preload, e.g. en_core_web_sm, none by default, each worker loads its own models
+    :param report: See execute
+    :param profile: See execute
+    :param resume: See execute
+    :return: Summary per file, in the same order as file_paths
+    """
+    from excelcy.cache import nlp_cache
+    for name in preload or []:
+        try:
+            nlp_cache.load(name=name)
+        except IOError:
+            pass
+
+    fn = functools.partial(batch_execute, report=report, profile=profile, resume=resume)
+    if workers <= 1 or len(file_paths) <= 1:
+        return [fn(file_path) for file_path in file_paths]
+
+    # fork shares the preloaded models, spawn is the only one available on Windows
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    with multiprocessing.get_context(method).Pool(processes=min(workers, len(file_paths))) as pool:
+        return pool.map(fn, file_paths, chunksize=1)
 
 
 def main(argv: list = None):
     # quick CLI execution
     args = argv or sys.argv
     if args[1] == 'execute':
-        excelcy = ExcelCy.execute(file_path=args[2])
+        excelcy = execute(file_path=args[2], report='--report' in args[3:], profile='--profile' in args[3:],
+                          resume='--resume' in args[3:])
+    elif args[1] == 'batch':
+        parser = argparse.ArgumentParser(prog='excelcy batch', description='Execute many storage files')
+        parser.add_argument('files', nargs='+', help='Storage file paths or globs, e.g. "jobs/**/*.xlsx"')
+        parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+        parser.add_argument('-p', '--preload', action='append',
+                            help='Model to share with the workers, repeatable, e.g. the nlp_base of the files')
+        parser.add_argument('-s', '--summary', default='batch_summary.json', help='Summary JSON file path')
+        parser.add_argument('--report', action='store_true', help='Save phase report next to each storage file')
+        parser.add_argument('--profile', action='store_true', help='Save cProfile of each phase, implies --report')
+        parser.add_argument('--resume', action='store_true', help='Resume each from its checkpoint')
+        opts = parser.parse_args(args[2:])
+
+        summaries = batch(file_paths=batch_files(patterns=opts.files), workers=opts.workers,
+                          preload=opts.preload, report=opts.report, profile=opts.profile,
+                          resume=opts.resume)
+        utils.json_save(data=summaries, file_path=opts.summary)
+        for summary in summaries:
+            print('%s %s %.1fs %s' % ('OK  ' if summary['ok'] else 'FAIL', summary['file_path'], summary['seconds'],
+                                      summary['error'] or ''))
+        return 0 if all(summary['ok'] for summary in summaries) else 1
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,131 @@
+import hashlib
+import typing
+import zlib
+import numpy
+from excelcy.utils import odict
+
+# Mersenne prime 2^31 - 1, the permutation a * hash + b stays within uint64 for 32 bits hash
+PRIME = (1 << 31) - 1
+
+
+class MinHashLSH(object):
+    def __init__(self, threshold: float, num_perm: int = 64, shingle: int = 5, max_entries: int = 1000000,
+                 bucket_size: int = 8, seed: int = 1):
+        """
+        Near-duplicate index of texts with MinHash signatures of the character shingles and LSH banding, described in
+        https://en.wikipedia.org/wiki/MinHash. The bands and rows are chosen to have the S-curve threshold
+        (1 / bands) ^ (1 / rows) nearest to the threshold, the candidates are then checked by the estimated Jaccard.
+
+        Memory is bounded by max_entries, the index is kept in two generations, the older one is dropped once the
+        newer one is full, so the texts are compared with at least the last max_entries / 2 inserted. Each bucket keeps
+        the first bucket_size signatures, a text similar to the later ones of a crowded bucket may be missed there,
+        but still found by its other bands.
+
+        :param threshold: Jaccard similarity to be near-duplicate, e.g. 0.8
+        :param num_perm: Number of permutations, the signature length
+        :param shingle: Number of characters per shingle
+        :param max_entries: Maximum signatures kept
+        :param bucket_size: Maximum signatures per bucket of a band
+        :param seed: Seed of the permutations
+        """
+        self.threshold = threshold
+        self.shingle = shingle
+        self.max_entries = max_entries
+        self.bucket_size = bucket_size
+        self.bands, self.rows = self.make_params(threshold=threshold, num_perm=num_perm)
+        rnd = numpy.random.RandomState(seed)
+        self.a = rnd.randint(1, PRIME, size=(num_perm, 1)).astype(numpy.uint64)
+        self.b = rnd.randint(0, PRIME, size=(num_perm, 1)).astype(numpy.uint64)
+        self.tables = [{} for _ in range(self.bands)]  # type: typing.List[typing.Dict[bytes, list]]
+        self.previous = []  # type: typing.List[typing.Dict[bytes, list]]
+        self.size = 0
+
+    @staticmethod
+    def make_params(threshold: float, num_perm: int) -> typing.Tuple[int, int]:
+        candidates = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+        return min(candidates, key=lambda params: abs((1 / params[0]) ** (1 / params[1]) - threshold))
+
+    def signature(self, text: str) -> numpy.ndarray:
+        text = ' '.join(text.lower().split())
+        shingles = set(text[i:i + self.shingle] for i in range(max(len(text) - self.shingle + 1, 1)))
+        hashes = numpy.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=numpy.uint64,
+                                count=len(shingles))
+        return ((self.a * hashes + self.b) % PRIME).min(axis=1).astype(numpy.uint32)
+
+    def insert(self, text: str) -> bool:
+        """
+        Insert the text unless it is near-duplicate of the texts inserted before
+        :param text: The text
+        :return: True if it is inserted, False if it is near-duplicate
+        """
+        signature = self.signature(text=text)
+        keys = [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+        for tables in [self.tables, self.previous]:
+            for table, key in zip(tables, keys):
+                for other in table.get(key, ()):
+                    if numpy.mean(other == signature) >= self.threshold:
+                        return False
+
+        if self.size >= self.max_entries // 2:
+            self.previous, self.tables, self.size = self.tables, [{} for _ in range(self.bands)], 0
+        for table, key in zip(self.tables, keys):
+            bucket = table.setdefault(key, [])
+            if len(bucket) < self.bucket_size:
+                bucket.append(signature)
+        self.size = self.size + 1
+        return True
+
+
+class SentenceFilter(object):
+    def __init__(self, min_length: int = 0, max_length: int = 0, dedup: bool = False, near_dup_threshold: float = 0,
+                 num_perm: int = 64, max_entries: int = 1000000):
+        """
+        Filter of the discovered sentences, by the length, exact duplicate with 64 bits hash of the text and
+        near-duplicate with MinHashLSH. The hashes are kept in two generations as MinHashLSH, so the memory is bounded
+        by max_entries. The number of sentences kept and dropped by each reason are in stats.
+
+        :param min_length: Minimum characters, 0 for no limit
+        :param max_length: Maximum characters, 0 for no limit
+        :param dedup: Drop the exact duplicates
+        :param near_dup_threshold: Jaccard similarity to drop the near-duplicates, 0 to disable
+        :param num_perm: Number of MinHash permutations
+        :param max_entries: Maximum hashes and signatures kept
+        """
+        self.min_length = min_length
+        self.max_length = max_length
+        self.dedup = dedup
+        self.max_entries = max_entries
+        self.lsh = MinHashLSH(threshold=near_dup_threshold, num_perm=num_perm,
+                              max_entries=max_entries) if near_dup_threshold else None
+        self.stats = odict([('kept', 0), ('too_short', 0), ('too_long', 0), ('duplicate', 0), ('near_duplicate', 0)])
+        self._hashes, self._previous = set(), set()  # type: typing.Set[bytes], typing.Set[bytes]
+
+    def _reason(self, text: str) -> typing.Optional[str]:
+        if len(text) < self.min_length:
+            return 'too_short'
+        if self.max_length and len(text) > self.max_length:
+            return 'too_long'
+        if self.dedup:
+            key = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+            if key in self._hashes or key in self._previous:
+                return 'duplicate'
+            if len(self._hashes) >= self.max_entries // 2:
+                self._previous, self._hashes = self._hashes, set()
+            self._hashes.add(key)
+        if self.lsh is not None and not self.lsh.insert(text=text):
+            return 'near_duplicate'
+        return None
+
+    def check(self, text: str) -> bool:
+        """
+        Check the sentence and count it in stats
+        :param text: The sentence
+        :return: True if it is kept
+        """
+        reason = self._reason(text=text)
+        self.stats[reason or 'kept'] += 1
+        return reason is None
+
+    @property
+    def dropped(self) -> int:
+        return sum(count for reason, count in self.stats.items() if reason != 'kept')
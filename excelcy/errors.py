@@ -14,3 +14,4 @@ def add_codes(err_cls):
 class Errors:
     """ List of identified error """
     E001 = 'Error on loading data configuration file.'
+    E002 = 'Config train_eval_sheet needs the storage loaded from file.'
@@ -1,20 +1,48 @@
+import cProfile
+import functools
+import glob
+import io
+import logging
 import os
+import shutil
 import warnings
 import random
-import spacy
+import re
+import time
 import typing
+import zlib
 
 from excelcy import utils
+from excelcy.cache import PrepareCache, TrainCache, load_nlp, nlp_cache
 from excelcy.errors import Errors
-from excelcy.pipe import MatcherPipe, EXCELCY_MATCHER
-from excelcy.storage import Storage, Source, Prepare, Train
+from excelcy.storage import Storage, Source, Prepare
 from excelcy.utils import odict
 
+# spaCy, the pipe and numpy are imported when the nlp is needed, so the storage operations start fast
+if typing.TYPE_CHECKING:
+    from spacy.tokens import Doc
+    from excelcy.dedup import SentenceFilter
+    from excelcy.pipe import MatcherPipe
+
 # remove warnings from numpy
 # reference: https://stackoverflow.com/questions/40845304/runtimewarning-numpy-dtype-size-changed-may-indicate-binary-incompatibility
 warnings.filterwarnings('ignore', message='numpy.dtype size changed')
 warnings.filterwarnings('ignore', message='numpy.ufunc size changed')
 
+logger = logging.getLogger(__name__)
+
+
+def textract_process(file_path: typing.Optional[str], language: str = None) -> typing.Optional[bytes]:
+    """
+    Extract the text with textract, it is in module level to be pickled into the process pool
+    :param file_path: The file path, None is passed through
+    :param language: The language for OCR
+    """
+    if file_path is None:
+        return None
+    import textract
+    return textract.process(file_path, language=language)
+
 
 class ExcelCy(object):
     def __init__(self, storage_cls=None):
@@ -22,26 +50,219 @@ class ExcelCy(object):
         self.storage = storage_cls()  # type: Storage
         self.errors = []  # type: typing.List[BaseException]
         self._nlp = None
+        # pipe names shared with the model cache, see _own_pipe
+        self._nlp_shared = set()  # type: typing.Set[str]
+        # sentences kept and dropped by the discover filter, see _discover_filter_open
+        self.discover_stats = odict()
+        self._discover_filter = None  # type: SentenceFilter
+        self._prepare_cache = None  # type: PrepareCache
+        self.train_stats = []  # type: typing.List[dict]
+        # spans dropped by the offset resolution of train, see _train_examples
+        self.train_issues = []  # type: typing.List[dict]
+        self._train_cache = None  # type: TrainCache
+        self.phase_stats = []  # type: typing.List[dict]
+        # checkpoint state of run, see _checkpoint_open
+        self._checkpoint = None  # type: dict
+        # number of items processed, e.g. sentences, texts or examples, it is reported per phase
+        self._phase_items = 0
 
     @classmethod
     def execute(cls, file_path: str):
         excelcy = cls()
         excelcy.load(file_path=file_path)
+        return excelcy.run()
 
+    def run(self):
+        """
+        Execute the enabled phases in order, the default phases are added if there is none.
+        Each phase is recorded in phase_stats, including the failed one. With config phase_report, the stats are
+        saved next to the storage file, and with config phase_profile, cProfile of each phase as well.
+        With config checkpoint_path, the state is saved after each phase, and with config checkpoint_resume, the
+        phases done in the previous run are skipped.
+        """
         # prepare the phases
-        phases = excelcy.storage.phase
+        phases = self.storage.phase
         if len(phases.items) == 0:
             # get default phases
             for fn in ['discover', 'prepare', 'train', 'save_nlp']:
                 phases.add(fn=fn)
 
         # execute the fns
-        for idx, phase in excelcy.storage.phase.items.items():
-            if phase.enabled:
-                fno = getattr(excelcy, phase.fn)
-                fno(**phase.args)
+        self._checkpoint_open()
+        try:
+            for idx, phase in self.storage.phase.items.items():
+                if not phase.enabled:
+                    continue
+                if self._checkpoint and idx in self._checkpoint['phases']:
+                    logger.info('Phase %s %s is done in the checkpoint, skipped', idx, phase.fn)
+                    continue
+                self._run_phase(idx=idx, fn=phase.fn, args=phase.args)
+                self._checkpoint_phase(idx=idx)
+        finally:
+            if utils.parse_bool(self.storage.config.phase_report):
+                self._save_phase_report()
 
-        return excelcy
+        return self
+
+    def _run_phase(self, idx: str, fn: str, args: dict):
+        """
+        Execute the phase and record its wall time, CPU time of this process and its workers, memory and items
+        processed. The peak memory is of the process since it is started, its growth in the phase is peak_rss_delta_mb.
+        """
+        fno = getattr(self, fn)
+        profile_path = self._phase_path(suffix='.%s.%s.prof' % (idx, fn))
+        profiler = cProfile.Profile() if profile_path and utils.parse_bool(self.storage.config.phase_profile) else None
+        stat = odict([('idx', idx), ('fn', fn), ('ok', False), ('seconds', 0.0), ('cpu_seconds', 0.0), ('items', 0),
+                      ('process_peak_rss_mb', None), ('peak_rss_delta_mb', None), ('profile', None)])
+        self.phase_stats.append(stat)
+        start, cpu_start, items_start, rss_start = time.time(), utils.cpu_time(), self._phase_items, utils.peak_rss()
+        if profiler:
+            profiler.enable()
+        try:
+            fno(**args)
+            stat['ok'] = True
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(profile_path)
+                stat['profile'] = profile_path
+            stat['seconds'] = time.time() - start
+            stat['cpu_seconds'] = utils.cpu_time() - cpu_start
+            stat['items'] = self._phase_items - items_start
+            stat['process_peak_rss_mb'] = utils.peak_rss()
+            if rss_start is not None:
+                stat['peak_rss_delta_mb'] = stat['process_peak_rss_mb'] - rss_start
+            logger.info('Phase %(idx)s %(fn)s: %(seconds).2fs, %(cpu_seconds).2fs CPU, %(items)s items', stat)
+
+    def _phase_path(self, suffix: str) -> typing.Optional[str]:
+        # next to the storage file, e.g. storage.xlsx into storage.report.json
+        file_path = self.storage.storage_path
+        if not file_path:
+            return None
+        return os.path.splitext(file_path)[0] + suffix
+
+    def _save_phase_report(self):
+        file_path = self._phase_path(suffix='.report.json')
+        if file_path:
+            report = odict([('storage_path', self.storage.storage_path), ('phases', self.phase_stats),
+                            ('discover', self.discover_stats), ('train', self.train_stats),
+                            ('train_issues', self.train_issues)])
+            utils.json_save(data=report, file_path=file_path)
+        return file_path
+
+    def _checkpoint_dir(self) -> typing.Optional[str]:
+        file_path = self.resolve_path(file_path=self.storage.config.checkpoint_path)
+        if file_path:
+            os.makedirs(file_path, exist_ok=True)
+        return file_path
+
+    def _checkpoint_open(self):
+        """
+        Start the checkpoint of run in the work directory of config checkpoint_path. With config checkpoint_resume,
+        the previous checkpoint is restored: the train storage, the model, the phases done and the train iteration.
+        """
+        self._checkpoint = None
+        path = self._checkpoint_dir()
+        if not path:
+            return
+        state_path = os.path.join(path, 'state.json')
+        self._checkpoint = odict([('phases', []), ('nlp', None), ('ner', None), ('train_iteration', 0),
+                                  ('train_best', None), ('train_stats', [])])
+        if not utils.parse_bool(self.storage.config.checkpoint_resume) or not os.path.exists(state_path):
+            # start over, the previous checkpoint is removed
+            for name in glob.glob(os.path.join(path, 'nlp.*')) + glob.glob(os.path.join(path, 'ner.*')):
+                shutil.rmtree(name, ignore_errors=True)
+            for name in ['state.json', 'train.msgpack']:
+                if os.path.exists(os.path.join(path, name)):
+                    os.remove(os.path.join(path, name))
+            return
+
+        self._checkpoint.update(utils.json_load(file_path=state_path))
+        # saved after the first phase done, train stopped before it is from the storage file as it is
+        if os.path.exists(os.path.join(path, 'train.msgpack')):
+            self.storage.load_train(file_path=os.path.join(path, 'train.msgpack'))
+        self.train_stats = list(self._checkpoint['train_stats'])
+        if self._checkpoint['nlp']:
+            self.storage.nlp_path = self.resolve_ensure_path(file_path=self.storage.config.nlp_name)
+            # loaded as it is, rather than from the model cache, so none of the pipes is shared
+            self._nlp = load_nlp(name=os.path.join(path, self._checkpoint['nlp']))
+            self._nlp_shared = set()
+        logger.info('Checkpoint is restored, phases done: %s', ', '.join(self._checkpoint['phases']))
+
+    def _checkpoint_save(self, nlp: str = None, ner: str = None):
+        """
+        Save the state, it refers to the new model directories, the previous ones are removed only after that,
+        so the state always refers to the complete ones
+        """
+        path = self._checkpoint_dir()
+        previous = [self._checkpoint[name] for name in ['nlp', 'ner'] if self._checkpoint[name]]
+        if nlp:
+            self._checkpoint['nlp'] = nlp
+        self._checkpoint['ner'] = ner
+        self._checkpoint['train_stats'] = self.train_stats
+        state_path = os.path.join(path, 'state.json')
+        utils.json_save(data=self._checkpoint, file_path=state_path + '.tmp')
+        os.replace(state_path + '.tmp', state_path)
+        for name in previous:
+            if name not in [self._checkpoint['nlp'], self._checkpoint['ner']]:
+                shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+    def _checkpoint_phase(self, idx: str):
+        """
+        Checkpoint after the phase is done, the train storage and the model if it is created
+        :param idx: The phase idx
+        """
+        if self._checkpoint is None:
+            return
+        path = self._checkpoint_dir()
+        train_path = os.path.join(path, 'train.msgpack')
+        self.storage.save(file_path=os.path.join(path, 'train.tmp.msgpack'), kind=['train'])
+        os.replace(os.path.join(path, 'train.tmp.msgpack'), train_path)
+        nlp = None
+        if self._nlp is not None:
+            nlp = 'nlp.%s' % idx
+            self._nlp.to_disk(os.path.join(path, nlp))
+        self._checkpoint['phases'].append(idx)
+        self._checkpoint['train_iteration'], self._checkpoint['train_best'] = 0, None
+        self._checkpoint_save(nlp=nlp)
+
+    def _checkpoint_train(self, ner, iteration: int, best: tuple = (None, None, None)):
+        """
+        Checkpoint within the train phase, only the ner pipe as the others are not trained.
+        The best scored weights are saved with it, as best.bin in the ner directory.
+        :param ner: The ner pipe
+        :param iteration: Number of iterations done
+        :param best: The best (f, iteration, weights) so far
+        """
+        if self._checkpoint is None:
+            return
+        name = 'ner.%s' % iteration
+        ner.to_disk(os.path.join(self._checkpoint_dir(), name), exclude=['vocab'])
+        best_f, best_itn, best_weights = best
+        if best_weights is not None:
+            with open(os.path.join(self._checkpoint_dir(), name, 'best.bin'), 'wb') as file:
+                file.write(best_weights)
+        self._checkpoint['train_iteration'] = iteration
+        self._checkpoint['train_best'] = [best_f, best_itn] if best_weights is not None else None
+        self._checkpoint_save(ner=name)
+        logger.info('Train checkpoint at iteration %s', iteration)
+
+    def _checkpoint_train_restore(self, ner) -> typing.Tuple[int, tuple]:
+        """
+        Restore the ner pipe of the train checkpoint, if any
+        :param ner: The ner pipe
+        :return: Number of iterations done and the best (f, iteration, weights) so far
+        """
+        if not self._checkpoint or not self._checkpoint['ner']:
+            return 0, (None, None, None)
+        path = os.path.join(self._checkpoint_dir(), self._checkpoint['ner'])
+        ner.from_disk(path, exclude=['vocab'])
+        best = (None, None, None)
+        if self._checkpoint.get('train_best'):
+            with open(os.path.join(path, 'best.bin'), 'rb') as file:
+                best = tuple(self._checkpoint['train_best']) + (file.read(),)
+        logger.info('Train continues from the checkpoint at iteration %s', self._checkpoint['train_iteration'])
+        return int(self._checkpoint['train_iteration']), best
 
     @property
     def nlp(self):
@@ -76,11 +297,18 @@ class ExcelCy(object):
         self.storage.save(file_path=file_path)
         return self
 
-    def save_nlp(self, file_path: str = None):
+    def save_nlp(self, file_path: str = None, keep_matcher: bool = None):
+        """
+        Save the NLP object into the file path or config nlp_name
+        :param file_path: The directory path
+        :param keep_matcher: Keep the matcher pipe with its patterns, default to config nlp_keep_matcher
+        """
+        from excelcy.pipe import EXCELCY_MATCHER
         nlp = self.nlp
+        keep_matcher = self.storage.config.nlp_keep_matcher if keep_matcher is None else keep_matcher
 
         # remove the pipe because it is not useful for other purposes rather than learning
-        if EXCELCY_MATCHER in nlp.pipe_names:
+        if EXCELCY_MATCHER in nlp.pipe_names and not utils.parse_bool(keep_matcher):
             nlp.remove_pipe(EXCELCY_MATCHER)
 
         # parse and ensure path
@@ -103,37 +331,105 @@ class ExcelCy(object):
 
         try:
             if self.storage.nlp_obj:
-                nlp = self.storage.nlp_obj
-            else:
-                # load NLP object with custom path to be loaded first, if fails, get the base which is lang code from spaCy.
-                nlp = spacy.load(name=self.storage.nlp_path)
+                self._nlp_shared = set()
+                return self.storage.nlp_obj
+            # load NLP object with custom path to be loaded first, if fails, get the base which is lang code from spaCy.
+            nlp = nlp_cache.load(name=self.storage.nlp_path, copy=True)
         except IOError:
             if not self.storage.config.nlp_base:
                 self.storage.config.nlp_base = 'en_core_web_sm'
-            nlp = spacy.load(name=self.storage.config.nlp_base)
+            nlp = nlp_cache.load(name=self.storage.config.nlp_base, copy=True)
+        # the copy has its own pipeline, but the pipes are from the cache
+        self._nlp_shared = set(nlp.pipe_names)
         return nlp
 
+    def _own_pipe(self, name: str):
+        """
+        Get the pipe to be mutated, e.g. trained or added patterns, the pipe shared with model cache is copied first
+        :param name: The pipe name
+        """
+        if name in self._nlp_shared:
+            self._nlp_shared.discard(name)
+            return nlp_cache.own_pipe(nlp=self.nlp, name=name)
+        return self.nlp.get_pipe(name)
+
+    def _discover_sents(self, texts: typing.Iterable[str]) -> typing.Iterator[str]:
+        """
+        Lazily split texts into sentences with rule based sentencizer, all other pipes are disabled
+        :param texts: Iterable of texts
+        """
+        nlp = self.nlp
+        sentencizer = nlp.create_pipe('sentencizer')
+        with nlp.disable_pipes(*nlp.pipe_names):
+            # chunks are already large, buffering more of them only grows the memory
+            docs = nlp.pipe(texts, batch_size=1)
+            for doc in sentencizer.pipe(docs, batch_size=1):
+                for sent in doc.sents:
+                    yield sent.text.strip()
+
+    def _discover_stream(self, lines: typing.Iterable[str], source: Source):
+        """
+        Stream lines in paragraph chunks into sentences, the memory is bounded by the chunk size
+        :param lines: Iterable of lines
+        :param source: The source of the lines
+        """
+        chunks = utils.iter_chunks(lines=lines, size=int(self.storage.config.discover_chunk_size or 100000))
+        for text in self._discover_sents(texts=chunks):
+            if text:
+                self._discover_add(text=text, source=source)
+
+    def _discover_add(self, text: str, source: Source):
+        """
+        Add the sentence into train, unless it is dropped by the discover filter
+        """
+        if self._discover_filter is None or self._discover_filter.check(text=text):
+            self.storage.train.add(text=text, source=str(source.idx))
+            self._phase_items = self._phase_items + 1
+
+    def _discover_filter_open(self) -> typing.Optional['SentenceFilter']:
+        """
+        The filter of config discover_min_length, discover_max_length, discover_dedup and discover_near_dup, None if
+        none of them is given
+        """
+        config = self.storage.config
+        min_length, max_length = int(config.discover_min_length or 0), int(config.discover_max_length or 0)
+        dedup, near_dup = utils.parse_bool(config.discover_dedup), float(config.discover_near_dup or 0)
+        if not (min_length or max_length or dedup or near_dup):
+            return None
+        from excelcy.dedup import SentenceFilter
+        return SentenceFilter(min_length=min_length, max_length=max_length, dedup=dedup, near_dup_threshold=near_dup,
+                              num_perm=int(config.discover_near_dup_perm or 64),
+                              max_entries=int(config.discover_dedup_size or 1000000))
+
     def _discover_text(self, source: Source):
         """
         Apply Sentence Boundary Detection, described here https://spacy.io/usage/linguistic-features#sbd
         :param source: The source value with kind=text
         """
+        if self.storage.config.discover_stream:
+            self._discover_stream(lines=utils.iter_lines(source.value), source=source)
+            return
+
         # this is based on SBD described here
         doc = self.nlp(source.value)
         for sent in doc.sents:
-            # TODO: would be good to add ref from source
-            # TODO: add filter?
             text = sent.text.strip()
-            self.storage.train.add(text=text)
+            self._discover_add(text=text, source=source)
 
-    def _discover_textract(self, source: Source):
+    def _discover_textract(self, source: Source, text: bytes = None):
         """
         Apply textract parsing, described here http://textract.readthedocs.io/en/stable/
         :param source: The source value with kind=textract
+        :param text: The text extracted in the worker pool, see discover
         """
-        import textract
         # process it
-        text = textract.process(self.resolve_path(file_path=source.value), language=self.storage.config.source_language)
+        if text is None:
+            text = textract_process(self.resolve_path(file_path=source.value), self.storage.config.source_language)
+        if self.storage.config.discover_stream:
+            # decode line by line rather than the whole document at once
+            self._discover_stream(lines=io.TextIOWrapper(io.BytesIO(text), encoding='utf-8'), source=source)
+            return
+
         # create new source and pass it to text processor
         value = text.decode('utf-8')
         new_source = Source(idx=source.idx, kind='text', value=value)
@@ -148,107 +444,397 @@ class ExcelCy(object):
 
     def discover(self):
         """
-        Start load source data, iterate one by one and parse into sentences
+        Start load source data, iterate one by one and parse into sentences. With config discover_workers, the textract
+        extraction runs ahead in thread or process pool (config discover_executor), the sentences are still split one
+        source by one, so the train is in the same order as without it.
+        The sentences are filtered by the discover filter, see _discover_filter_open, it is reported in discover_stats.
         """
-        for _, source in self.storage.source.items.items():
-            processor = getattr(self, '_discover_%s' % source.kind, None)
-            if processor:
-                processor(source=source)
+        self._discover_filter = self._discover_filter_open()
+        try:
+            self._discover_sources()
+        finally:
+            if self._discover_filter is not None:
+                self.discover_stats = self._discover_filter.stats
+                logger.info('Discover filter: %s sentences are kept, %s are dropped %s', self.discover_stats['kept'],
+                            self._discover_filter.dropped, dict(self.discover_stats))
+            self._discover_filter = None
         return self
 
-    def _prepare_init_base(self, prepare: Prepare):
-        pipe = self.nlp.get_pipe(EXCELCY_MATCHER)  # type: MatcherPipe
-        pipe.add_pattern(kind=prepare.kind, value=prepare.value, entity=prepare.entity)
-
-    def _prepare_init_phrase(self, prepare: Prepare):
-        self._prepare_init_base(prepare=prepare)
-
-    def _prepare_init_regex(self, prepare: Prepare):
-        self._prepare_init_base(prepare=prepare)
+    def _discover_sources(self):
+        config = self.storage.config
+        sources = [source for _, source in self.storage.source.items.items()]
+        workers = int(config.discover_workers or 1)
+        if workers <= 1:
+            for source in sources:
+                self._discover_source(source=source)
+            return
+
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        executor_cls = ProcessPoolExecutor if config.discover_executor == 'process' else ThreadPoolExecutor
+        file_paths = [self.resolve_path(file_path=source.value) if source.kind == 'textract' else None
+                      for source in sources]
+        fn = functools.partial(textract_process, language=config.source_language)
+        with executor_cls(max_workers=workers) as executor:
+            # only a few sources ahead are extracted, so the texts are not piled up while the sentences are split
+            texts = utils.iter_ordered_map(fn=fn, items=file_paths, executor=executor, window=workers * 2)
+            for source, text in zip(sources, texts):
+                self._discover_source(source=source, text=text)
+
+    def _discover_source(self, source: Source, text: bytes = None):
+        processor = getattr(self, '_discover_%s' % source.kind, None)
+        if processor and text is not None:
+            processor(source=source, text=text)
+        elif processor:
+            processor(source=source)
 
     def _prepare_init_file(self, prepare: Prepare):
-        wb = utils.excel_load(file_path=self.resolve_path(prepare.value))
-        for item in wb.get('prepare', []):
-            prepare = Prepare.make(items=item)
-            self._prepare_init_base(prepare=prepare)
+        from excelcy.pipe import EXCELCY_MATCHER
+        pipe = self.nlp.get_pipe(EXCELCY_MATCHER)  # type: MatcherPipe
+        with utils.excel_open(file_path=self.resolve_path(prepare.value)) as wb:
+            items = utils.excel_iter(wb=wb, name='prepare')
+            pipe.add_patterns(patterns=[Prepare.make(items=item).as_dict() for item in items])
 
-    def _prepare_parse(self, train: Train):
+    def _prepare_parse(self, idx: str, text: str, doc: 'Doc' = None):
         # parsing pre-identified Entity based on current data model
-        doc = self.nlp(train.text)
+        doc = self.nlp(text) if doc is None else doc
         for ent in doc.ents:
             subtext, offset, label = ent.text, '%s,%s' % (ent.start_char, ent.end_char), ent.label_
-            train.add(subtext=subtext, offset=offset, entity=label)
+            self.storage.train.add_gold(train_idx=idx, subtext=subtext, offset=offset, entity=label)
 
     def prepare(self):
         """
         Identify Entity from sentences
         """
         if self.storage.config.prepare_enabled:
+            from excelcy.pipe import MatcherPipe, EXCELCY_MATCHER
             # prepare nlp to add matcher pipe
-            self.nlp.add_pipe(MatcherPipe(self.nlp))
+            # the pipe may be restored with the saved model, keep the patterns and add more
+            if EXCELCY_MATCHER not in self.nlp.pipe_names:
+                config = self.storage.config
+                self.nlp.add_pipe(MatcherPipe(self.nlp, phrase_backend=config.prepare_phrase_backend or 'matcher',
+                                              phrase_attr=config.prepare_phrase_attr or 'ORTH',
+                                              regex_mode=config.prepare_regex_mode or 'token'))
+            else:
+                # more patterns are added into it
+                self._own_pipe(name=EXCELCY_MATCHER)
 
-            # parse data
+            # parse data, the phrase and regex patterns are added in bulk, the phrases are added once per entity
+            patterns = []
             for _, prepare in self.storage.prepare.items.items():
+                if prepare.kind in ['phrase', 'regex']:
+                    patterns.append({'kind': prepare.kind, 'value': prepare.value, 'entity': prepare.entity})
+                    continue
                 processor = getattr(self, '_prepare_init_%s' % prepare.kind, None)
                 if processor:
                     processor(prepare=prepare)
+            self.nlp.get_pipe(EXCELCY_MATCHER).add_patterns(patterns=patterns)
 
             # identify sentences
-            for _, train in self.storage.train.items.items():
-                self._prepare_parse(train=train)
+            self._prepare_parse_all()
         return self
 
+    def _prepare_cache_open(self) -> PrepareCache:
+        """
+        Open the prepare cache once per instance, the fingerprint is renewed as the model or patterns may be changed
+        """
+        if self._prepare_cache is None:
+            self._prepare_cache = PrepareCache(file_path=self.resolve_ensure_path(self.storage.config.prepare_cache))
+        self._prepare_cache.fingerprint = PrepareCache.make_fingerprint(nlp=self.nlp)
+        return self._prepare_cache
+
+    def _prepare_parse_cached(self, texts: typing.Iterable[tuple], cache: PrepareCache) -> typing.Iterator[tuple]:
+        """
+        Add the Gold annotations of the cached texts, only the new or changed texts are passed through
+        :param texts: Iterable of (text, idx)
+        :param cache: The prepare cache
+        """
+        for text, idx in texts:
+            ents = cache.get(text=text)
+            if ents is None:
+                yield text, idx
+                continue
+            for start, end, label in ents:
+                offset = '%s,%s' % (start, end)
+                self.storage.train.add_gold(train_idx=idx, subtext=text[start:end], offset=offset, entity=label)
+            self._phase_items = self._phase_items + 1
+
+    def _prepare_parse_all(self):
+        """
+        Stream all the train texts through nlp.pipe, the Gold annotations are written back in the same order.
+        With config prepare_cache, the texts annotated before by the same model and patterns are not parsed again.
+        """
+        config = self.storage.config
+        texts = ((text, idx) for idx, text in self.storage.train.iter_texts())
+        cache = self._prepare_cache_open() if config.prepare_cache else None
+        if cache is not None:
+            texts = self._prepare_parse_cached(texts=texts, cache=cache)
+        docs = self.nlp.pipe(texts, as_tuples=True, batch_size=int(config.prepare_batch_size or 1000),
+                             n_process=int(config.prepare_n_process or 1))
+        for doc, idx in docs:
+            self._prepare_parse(idx=idx, text=doc.text, doc=doc)
+            self._phase_items = self._phase_items + 1
+            if cache is not None:
+                cache.set(text=doc.text, ents=[(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents])
+        if cache is not None:
+            cache.save()
+            logger.info('Prepare cache: %s hits, %s misses', cache.hits, cache.misses)
+
+    def _train_examples(self, train, split: str = None) -> typing.Tuple[list, set]:
+        """
+        Convert the train storage into spaCy examples of (doc, {'entities': [(start, end, entity)]}).
+        The text is tokenized and its offsets are resolved once per text and golds (see _train_resolve) into the train
+        cache, later calls, e.g. retrain, only do the new or changed ones. The spans dropped are in train_issues,
+        labelled with the split, either "train" or "eval" for the held-out.
+
+        :param train: The train storage
+        :param split: Split of all the examples, by default the held-out of train_eval_split are "eval"
+        :return: The examples and unique entities
+        """
+        cache = self._train_cache or self._train_cache_open()
+        examples, entities, pending = [], set(), []
+        for idx, text, golds in train.iter_rows():
+            key = (text, tuple((subtext, start, end, entity) for _, subtext, start, end, entity in golds))
+            entities.update(entity for _, _, _, _, entity in golds)
+            examples.append([idx, cache.get(key=key)])
+            if examples[-1][1] is None:
+                pending.append((key, examples[-1]))
+
+        # tokenize only the texts to resolve, for the alignment check
+        config = self.storage.config
+        texts = (key[0] for key, _ in pending)
+        docs = self.nlp.tokenizer.pipe(texts, batch_size=int(config.prepare_batch_size or 1000))
+        for (key, example), doc in zip(pending, docs):
+            example[1] = (doc,) + self._train_resolve(doc=doc, golds=key[1])
+            cache.set(key=key, entry=example[1])
+
+        issues = [odict([('idx', idx), ('split', split or ('eval' if self._train_held_out(doc.text) else 'train'))] +
+                        list(issue.items())) for idx, (doc, _, items) in examples for issue in items]
+        if issues:
+            logger.warning('Train offsets: %s spans are dropped, see train_issues', len(issues))
+        self.train_issues.extend(issues)
+        return [(doc, {'entities': ents}) for _, (doc, ents, _) in examples], entities
+
+    def _train_cache_open(self) -> TrainCache:
+        """
+        Open the train cache once per instance, in memory only unless config train_cache is given
+        """
+        if self._train_cache is None:
+            self._train_cache = TrainCache(file_path=self.resolve_ensure_path(self.storage.config.train_cache))
+        return self._train_cache.open(nlp=self.nlp)
+
+    def _train_resolve(self, doc: 'Doc', golds: tuple) -> typing.Tuple[list, list]:
+        """
+        Resolve the golds of the text into entity offsets, the golds without offset are all the occurrences of the
+        subtext, found in one pass. The subtext only inside a longer match, e.g. "Eats" in "Uber Eats", is searched
+        on its own. The spans must align with the tokens and must not overlap, the golds with offset are taken first,
+        then the longest at the same position.
+
+        :param doc: The tokenized text
+        :param golds: Tuple of (subtext, start, end, entity)
+        :return: List of (start, end, entity) and list of the spans dropped with the reason
+        """
+        text, spans, issues, subtexts = doc.text, [], [], odict()
+
+        def issue(subtext: str, start: int, end: int, entity: str, reason: str):
+            issues.append(odict([('subtext', subtext), ('start', start), ('end', end),
+                                 ('entity', entity), ('reason', reason)]))
+
+        for subtext, start, end, entity in golds:
+            if start is not None:
+                spans.append((0, start, end, entity, subtext))
+            elif subtext and subtexts.setdefault(subtext, entity) != entity:
+                issue(subtext=subtext, start=None, end=None, entity=entity, reason='conflict')
+        if subtexts:
+            # the longest first, so it is matched rather than its prefix
+            pattern = re.compile('|'.join(re.escape(subtext) for subtext in sorted(subtexts, key=len, reverse=True)))
+            found = set()
+            for match in pattern.finditer(text):
+                found.add(match.group())
+                spans.append((1, match.start(), match.end(), subtexts[match.group()], match.group()))
+            for subtext, entity in subtexts.items():
+                if subtext in found:
+                    continue
+                # the matches do not overlap, it may be inside a longer one, then it is reported as overlap
+                start = text.find(subtext)
+                if start < 0:
+                    issue(subtext=subtext, start=None, end=None, entity=entity, reason='not_found')
+                while start >= 0:
+                    spans.append((1, start, start + len(subtext), entity, subtext))
+                    start = text.find(subtext, start + 1)
+
+        ents = []
+        for _, start, end, entity, subtext in sorted(spans, key=lambda span: (span[0], span[1], span[1] - span[2])):
+            if (start, end, entity) in ents:
+                continue
+            if not 0 <= start < end <= len(text):
+                reason = 'invalid'
+            elif doc.char_span(start, end) is None:
+                reason = 'misaligned'
+            elif any(start < ent_end and ent_start < end for ent_start, ent_end, _ in ents):
+                reason = 'overlap'
+            else:
+                ents.append((start, end, entity))
+                continue
+            issue(subtext=subtext, start=start, end=end, entity=entity, reason=reason)
+        return sorted(ents), issues
+
+    def _train_split(self, examples: list) -> typing.Tuple[list, list]:
+        """
+        Split the held-out examples to evaluate, either from config train_eval_sheet of the storage file,
+        train_eval_file or train_eval_split of the train.
+        The split is by hash of the text, so it is the same on every run and regardless the order.
+        :param examples: The train examples
+        :return: The examples to train and to evaluate
+        """
+        config = self.storage.config
+        if config.train_eval_sheet:
+            if not self.storage.storage_path:
+                raise ValueError(Errors.E002)
+            train = self.storage.load_train_sheet(file_path=self.storage.storage_path, name=config.train_eval_sheet)
+            return examples, self._train_examples(train=train, split='eval')[0]
+        if config.train_eval_file:
+            storage = type(self.storage)()
+            storage.load(file_path=self.resolve_path(file_path=config.train_eval_file))
+            return examples, self._train_examples(train=storage.train, split='eval')[0]
+        train_examples, eval_examples = [], []
+        for example in examples:
+            (eval_examples if self._train_held_out(example[0].text) else train_examples).append(example)
+        return train_examples, eval_examples
+
+    def _train_held_out(self, text: str) -> bool:
+        # held-out of config train_eval_split, unless the held-out is from train_eval_sheet or train_eval_file
+        config = self.storage.config
+        split = float(config.train_eval_split or 0)
+        if split <= 0 or config.train_eval_sheet or config.train_eval_file:
+            return False
+        return zlib.crc32(text.encode('utf-8')) % 10000 < split * 10000
+
+    def evaluate(self, examples: list) -> odict:
+        """
+        Score the entities of nlp against the examples, the entity is correct if its offsets and label are exact.
+        All the enabled pipes are applied, e.g. train scores only the ner pipe.
+        :param examples: List of (text or doc, {'entities': [[start, end, entity]]})
+        :return: Precision, recall and F-score, in total and per entity
+        """
+        counts = odict()
+        # the text rather than the doc, the cached doc must not be annotated
+        texts = (doc if isinstance(doc, str) else doc.text for doc, _ in examples)
+        for doc, (_, annotations) in zip(self.nlp.pipe(texts), examples):
+            golds = set((start, end, entity) for start, end, entity in annotations['entities'])
+            preds = set((ent.start_char, ent.end_char, ent.label_) for ent in doc.ents)
+            for kind, items in [('tp', golds & preds), ('fn', golds - preds), ('fp', preds - golds)]:
+                for _, _, entity in items:
+                    counts.setdefault(entity, {'tp': 0, 'fp': 0, 'fn': 0})[kind] += 1
+
+        def score(tp: int, fp: int, fn: int) -> odict:
+            p = tp / (tp + fp) if tp + fp else 0.0
+            r = tp / (tp + fn) if tp + fn else 0.0
+            return odict([('p', p), ('r', r), ('f', 2 * p * r / (p + r) if p + r else 0.0)])
+
+        totals = [sum(count[kind] for count in counts.values()) for kind in ['tp', 'fp', 'fn']]
+        scores = score(*totals)
+        scores['ents_per_type'] = odict((entity, score(**counts[entity])) for entity in sorted(counts))
+        return scores
+
     def train(self):
+        """
+        Train the ner pipe for config train_iteration, with held-out examples (see _train_split), it is scored after
+        each iteration and stops early by config train_patience or train_target_score. The best iteration is kept.
+        """
+        from spacy.gold import GoldParse
+        from spacy.util import minibatch
         nlp = self.nlp
 
-        # gather unique entities
-        entities = []
-        for _, train in self.storage.train.items.items():
-            for _, gold in train.items.items():
-                entities.append(gold.entity)
+        # prepare data and gather unique entities
+        self.train_issues = []
+        cache = self._train_cache_open()
+        examples, entities = self._train_examples(train=self.storage.train)
+        examples, eval_examples = self._train_split(examples=examples)
+        if cache.file_path:
+            cache.save()
+            logger.info('Train cache: %s hits, %s misses', cache.hits, cache.misses)
+        # the gold objects are built once, and reused in every iteration
+        golds = [(doc, GoldParse(doc, **annotations)) for doc, annotations in examples]
 
         # add custom entities based on https://spacy.io/usage/training#example-new-entity-type
-        ner = nlp.get_pipe('ner')
-        for entity in set(entities):
+        ner = self._own_pipe(name='ner')
+        for entity in entities:
             ner.add_label(entity)
 
-        # prepare data
-        train_idx = list(self.storage.train.items.keys())
-        trains = odict()
-        for idx, train in self.storage.train.items.items():
-            entities = odict()
-            for gold_idx, gold in train.items.items():
-                # ensure offset is valid positions
-                if not gold.offset:
-                    offset = train.text.find(gold.subtext)
-                    if offset != -1 or gold.offset is None:
-                        gold.offset = '%s,%s' % (offset, offset + len(gold.subtext))
-                offset = gold.offset.replace(' ', '').strip()
-                if not entities.get(offset):
-                    entities[offset] = gold.entity
-            trains[idx] = {'entities': []}
-            for offset, entity in entities.items():
-                offsets = offset.split(',')
-                trains[idx]['entities'].append([int(offsets[0]), int(offsets[1]), entity])
-
-        # train now
-        nlp.vocab.vectors.name = 'spacy_pretrained_vectors'
-        optimizer = nlp.begin_training()
-        for itn in range(self.storage.config.train_iteration):
-            random.shuffle(train_idx)
-            for idx in train_idx:
-                text = self.storage.train.items[idx].text
-                train = trains[idx]
-                nlp.update([text], [train], drop=self.storage.config.train_drop, sgd=optimizer)
+        # train now, only the ner pipe is trained based on https://spacy.io/usage/training#example-train-ner
+        config = self.storage.config
+        patience = int(config.train_patience or 0)
+        target_score = float(config.train_target_score) if config.train_target_score is not None else None
+        n_stats = len(self.train_stats)
+        other_pipes = [name for name in nlp.pipe_names if name != 'ner']
+        with nlp.disable_pipes(*other_pipes):
+            nlp.vocab.vectors.name = 'spacy_pretrained_vectors'
+            optimizer = nlp.begin_training()
+            # continue from the last train checkpoint with the best so far, the optimizer starts over
+            start_itn, (best_f, best_itn, best_weights) = self._checkpoint_train_restore(ner=ner)
+            # the stats of this train, including the ones restored
+            n_stats = n_stats - start_itn
+            checkpoint_every = int(config.train_checkpoint_every or 0)
+            for itn in range(start_itn, config.train_iteration):
+                random.shuffle(golds)
+                losses = {}
+                start = time.time()
+                for batch in minibatch(golds, size=self._train_batch_size()):
+                    docs, batch_golds = zip(*batch)
+                    nlp.update(docs, batch_golds, drop=config.train_drop, sgd=optimizer, losses=losses)
+                seconds = time.time() - start
+                stat = odict([('iteration', itn + 1), ('loss', losses.get('ner', 0.0)), ('examples', len(examples)),
+                              ('seconds', seconds), ('eps', len(examples) / seconds if seconds else 0.0)])
+                self.train_stats.append(stat)
+                self._phase_items = self._phase_items + len(examples)
+                logger.info('Train iteration %(iteration)s: loss=%(loss).4f, %(eps).1f examples/s', stat)
+                if eval_examples:
+                    # score the held-out, only the ner pipe is enabled, so the matcher does not add the entities
+                    stat['eval'] = self.evaluate(examples=eval_examples)
+                    logger.info('Train iteration %s: P=%.4f R=%.4f F=%.4f', itn + 1, stat['eval']['p'],
+                                stat['eval']['r'], stat['eval']['f'])
+                    if best_f is None or stat['eval']['f'] > best_f:
+                        best_f, best_itn, best_weights = stat['eval']['f'], itn + 1, ner.to_bytes(exclude=['vocab'])
+                if checkpoint_every and (itn + 1) % checkpoint_every == 0 and itn + 1 < config.train_iteration:
+                    self._checkpoint_train(ner=ner, iteration=itn + 1, best=(best_f, best_itn, best_weights))
+                if not eval_examples:
+                    continue
+                if target_score is not None and stat['eval']['f'] >= target_score:
+                    logger.info('Train stops at iteration %s, target score is reached', itn + 1)
+                    break
+                if patience and itn + 1 - best_itn >= patience:
+                    logger.info('Train stops at iteration %s, no improvement since iteration %s', itn + 1, best_itn)
+                    break
+
+            if best_weights is not None and best_itn != self.train_stats[-1]['iteration']:
+                ner.from_bytes(best_weights, exclude=['vocab'])
+                logger.info('Train keeps the best iteration %s: F=%.4f', best_itn, best_f)
+        # the weights are hashed again in the prepare cache fingerprint
+        PrepareCache.forget(pipe=ner)
+        if best_itn is not None:
+            for stat in self.train_stats[n_stats:]:
+                stat['best'] = stat['iteration'] == best_itn
 
         return self
 
+    def _train_batch_size(self):
+        """
+        Batch size schedule, either fixed train_batch_size or compounding up to train_batch_size_end
+        described in https://spacy.io/usage/training#tips-batch-size
+        """
+        from spacy.util import compounding
+        config = self.storage.config
+        start = int(config.train_batch_size or 1)
+        end = int(config.train_batch_size_end or start)
+        if start == end:
+            return start
+        return compounding(start, end, float(config.train_batch_compound or 1.001))
+
     def retest(self):
-        for idx, train in self.storage.train.items.items():
-            # clear before retest the entities
-            train.items = odict()
-            # it is the same concept as prepare
-            self._prepare_parse(train=train)
+        # clear before retest the entities
+        self.storage.train.clear_golds()
+        # it is the same concept as prepare
+        self._prepare_parse_all()
 
     def export_train(self, file_path: str):
         self.storage.save(file_path=self.resolve_ensure_path(file_path), kind=['train'])
@@ -1,64 +1,258 @@
+import bisect
+import os
 import re
+import srsly
+import typing
 from spacy.language import Language
 from spacy.matcher import PhraseMatcher, Matcher
 from spacy.tokens import Span
 from spacy.tokens.doc import Doc
+from excelcy.trie import PhraseTrie
+from excelcy.utils import odict
 
 EXCELCY_MATCHER = 'excelcy-matcher'
+# maximum token texts kept with their regex entities, see MatcherPipe._regex_token_spans
+TOKEN_CACHE_SIZE = 1000000
+# backreference or conditional by group number or name, the groups are renumbered in the alternation of the patterns
+GROUP_REFERENCE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
 
 
 class MatcherPipe(object):
     name = EXCELCY_MATCHER
 
-    def __init__(self, nlp, patterns: list = None):
+    def __init__(self, nlp, patterns: list = None, phrase_backend: str = 'matcher', phrase_attr: str = 'ORTH',
+                 regex_mode: str = 'token'):
         """
         SpaCy pipe to match Entity based on multiple patterns.
 
         Pattern examples:
         patterns = [
             {'kind': 'phrase', 'value': 'amazon', 'entity': 'PRODUCT'},
-            {'kind': 'regex', 'value': 'ama(.+)', 'entity': 'PRODUCT'}
+            {'kind': 'regex', 'value': r'ama\w+', 'entity': 'PRODUCT'}
         ]
 
         :param nlp: The NLP object
         :param patterns: The matcher patterns
+        :param phrase_backend: Phrase matcher algo, either 'matcher' for PhraseMatcher or 'trie' for PhraseTrie
+        :param phrase_attr: Token attribute to match phrases, e.g. ORTH, LOWER or NORM
+        :param regex_mode: Either 'token' to match the regex from the start of each token, the entity is the token,
+            or 'text' to scan the doc text, the match starts at a token and can span multiple tokens
         """
         self.nlp = nlp
-        self.phrase_matcher = PhraseMatcher(nlp.vocab)
-        self.matcher = Matcher(nlp.vocab)
+        self.reset(phrase_backend=phrase_backend, phrase_attr=phrase_attr, regex_mode=regex_mode)
 
         self.extra_patterns = []
         # start add pattern
         self.add_patterns(patterns=patterns or [])
 
+    def reset(self, phrase_backend: str = 'matcher', phrase_attr: str = 'ORTH', regex_mode: str = 'token'):
+        """
+        Remove all patterns and create new matchers
+
+        :param phrase_backend: Phrase matcher algo, either 'matcher' for PhraseMatcher or 'trie' for PhraseTrie
+        :param phrase_attr: Token attribute to match phrases, e.g. ORTH, LOWER or NORM
+        :param regex_mode: Either 'token' or 'text', see __init__
+        """
+        self.phrase_backend, self.phrase_attr, self.regex_mode = phrase_backend, phrase_attr, regex_mode
+        if phrase_backend == 'trie':
+            self.phrase_matcher = PhraseTrie(self.nlp.vocab, attr=phrase_attr)
+        else:
+            self.phrase_matcher = PhraseMatcher(self.nlp.vocab, attr=phrase_attr)
+        self.matcher = Matcher(self.nlp.vocab)
+        # the phrase and regex values are kept in odict keys per entity to ignore the duplicates, they are serialized
+        self.phrase_patterns = odict()  # type: typing.Dict[str, typing.Dict[str, bool]]
+        self.regex_patterns = odict()  # type: typing.Dict[str, typing.Dict[str, bool]]
+        self._regexes = None
+        # entities matched per token text in token mode, the same text is matched only once
+        self._token_entities = {}  # type: typing.Dict[int, typing.List[str]]
+
     def add_patterns(self, patterns: list):
         """
-        Add pattern list into matcher algo.
+        Add pattern list into matcher algo. Phrase patterns are grouped per entity and added in bulk.
 
         :param patterns: List of pattern
         """
+        phrases = odict()
         for pattern in patterns:
             kind, value, entity = pattern.get('kind'), pattern.get('value'), pattern.get('entity')
-            self.add_pattern(kind=kind, value=value, entity=entity)
+            if kind == 'phrase':
+                phrases.setdefault(entity, []).append(value)
+            else:
+                self.add_pattern(kind=kind, value=value, entity=entity)
+        for entity, values in phrases.items():
+            self.add_phrases(values=values, entity=entity)
+
+    def add_phrases(self, values: list, entity: str):
+        """
+        Add phrase patterns into PhraseMatcher in one call, the patterns only need the tokenizer.
+        The phrase added before for the entity is ignored.
+
+        :param values: List of phrase
+        :param entity: Entity to be matched
+        """
+        phrases = self.phrase_patterns.setdefault(entity, odict())
+        values = [value for value in odict.fromkeys(values) if value not in phrases]
+        if values:
+            phrases.update((value, True) for value in values)
+            docs = list(self.nlp.tokenizer.pipe(values))
+            self.phrase_matcher.add(entity, None, *docs)
 
     def add_pattern(self, kind: str, value, entity: str):
         """
         Add pattern into matcher algorithm. There are two different types:
         - phrase: This uses PhraseMatcher which described in https://spacy.io/usage/linguistic-features#adding-phrase-patterns
-        - regex: This uses Matcher which described in https://spacy.io/usage/linguistic-features#regex
+        - regex: This matches each token text as re.match, or scans the doc text in 'text' regex_mode, similar to
+          https://spacy.io/usage/rule-based-matching#regex-text
 
         :param kind: Pattern matcher type, either 'phrase', 'regex'
         :param value: Entity pattern matcher
         :param entity: Entity to be matched
         """
         if kind == 'phrase':
-            self.phrase_matcher.add(entity, None, *[self.nlp(value)])
+            self.add_phrases(values=[value], entity=entity)
         elif kind == 'regex':
-            regex_flag = self.nlp.vocab.add_flag(lambda text: self.eval_regex(pattern=value, text=text))
-            self.matcher.add(entity, None, [{regex_flag: True}])
+            self.regex_patterns.setdefault(entity, odict())[value] = True
+            # compile again on the next call
+            self._regexes, self._token_entities = None, {}
+
+    @property
+    def regexes(self) -> typing.List[typing.Tuple[str, typing.Pattern]]:
+        """
+        Compiled regex patterns, each entity patterns are combined into one alternation and compiled only once.
+        The patterns which refer to their groups, e.g. backreference (\\w)\\1, are compiled on their own.
+        """
+        if self._regexes is None:
+            self._regexes = []
+            for entity, values in self.regex_patterns.items():
+                combined = [value for value in values if not GROUP_REFERENCE.search(value)]
+                try:
+                    if combined:
+                        self._regexes.append((entity, re.compile('|'.join(['(?:%s)' % value for value in combined]))))
+                except re.error:
+                    # e.g. global flags in the middle of alternation, compile them one by one
+                    self._regexes.extend([(entity, re.compile(value)) for value in combined])
+                self._regexes.extend([(entity, re.compile(value)) for value in values if GROUP_REFERENCE.search(value)])
+        return self._regexes
+
+    def _regex_token_spans(self, doc: Doc) -> typing.List[Span]:
+        """
+        Match the regexes from the start of each token, the same token text is matched once per pipe
+        """
+        if len(self._token_entities) > TOKEN_CACHE_SIZE:
+            self._token_entities = {}
+        spans = []
+        for token in doc:
+            entities = self._token_entities.get(token.orth)
+            if entities is None:
+                entities = [entity for entity, regex in self.regexes if regex.match(token.text)]
+                self._token_entities[token.orth] = entities
+            spans.extend([Span(doc, token.i, token.i + 1, label=entity) for entity in entities])
+        return spans
+
+    def _regex_text_spans(self, doc: Doc) -> typing.List[Span]:
+        """
+        Scan the regexes over the doc text, the match must start at a token, and it is expanded to the token end
+        """
+        spans = []
+        starts = {token.idx: token.i for token in doc}
+        ends = [token.idx + len(token) for token in doc]
+        for entity, regex in self.regexes:
+            for match in regex.finditer(doc.text):
+                start = starts.get(match.start())
+                if start is None or match.end() <= match.start():
+                    continue
+                end = bisect.bisect_left(ends, match.end(), lo=start) + 1
+                spans.append(Span(doc, start, min(end, len(doc)), label=entity))
+        return spans
+
+    def _get_cfg(self) -> dict:
+        return {
+            'phrase_backend': self.phrase_backend,
+            'phrase_attr': self.phrase_attr,
+            'regex_mode': self.regex_mode,
+            'regex_patterns': {entity: list(values) for entity, values in self.regex_patterns.items()}
+        }
+
+    def _set_cfg(self, cfg: dict, phrase_matcher=None):
+        self.reset(phrase_backend=cfg.get('phrase_backend', 'matcher'), phrase_attr=cfg.get('phrase_attr', 'ORTH'),
+                   regex_mode=cfg.get('regex_mode', 'token'))
+        for entity, values in cfg.get('regex_patterns', {}).items():
+            for value in values:
+                self.add_pattern(kind='regex', value=value, entity=entity)
+        if phrase_matcher is not None:
+            # the phrases are already in the given matcher, no need to tokenize again
+            self.phrase_matcher = phrase_matcher
+
+    def _get_phrases(self) -> dict:
+        return {entity: list(values) for entity, values in self.phrase_patterns.items()}
 
-    def eval_regex(self, pattern, text):
-        return bool(re.compile(pattern).match(text))
+    def _set_phrases(self, phrases: dict, compiled: bool = False):
+        """
+        Add the phrase values per entity
+        :param phrases: Phrase values per entity
+        :param compiled: The phrases are already in the phrase matcher, they are not tokenized again
+        """
+        for entity, values in phrases.items():
+            if compiled:
+                self.phrase_patterns.setdefault(entity, odict()).update((value, True) for value in values)
+            else:
+                self.add_phrases(values=values, entity=entity)
+
+    def to_bytes(self, exclude=tuple(), **kwargs):
+        """
+        Serialize the patterns, described in https://spacy.io/usage/saving-loading#custom-components
+        The phrases are serialized as text per entity, with PhraseTrie arrays as well for the trie backend.
+
+        :return: The serialized patterns
+        """
+        data = {'cfg': self._get_cfg(), 'phrases': self._get_phrases()}
+        if isinstance(self.phrase_matcher, PhraseTrie):
+            data['trie'] = self.phrase_matcher.to_bytes()
+        return srsly.msgpack_dumps(data)
+
+    def from_bytes(self, bytes_data, exclude=tuple(), **kwargs):
+        """
+        Load the patterns from bytes, the phrases of PhraseTrie are not tokenized again
+
+        :param bytes_data: The serialized patterns
+        """
+        data = srsly.msgpack_loads(bytes_data)
+        phrase_matcher = None
+        if data['cfg'].get('phrase_backend') == 'trie' and data.get('trie'):
+            phrase_matcher = PhraseTrie(self.nlp.vocab).from_bytes(data['trie'])
+        self._set_cfg(cfg=data['cfg'], phrase_matcher=phrase_matcher)
+        self._set_phrases(phrases=data.get('phrases', {}), compiled=phrase_matcher is not None)
+        return self
+
+    def to_disk(self, path, exclude=tuple(), **kwargs):
+        """
+        Save the patterns into directory, the phrases as text per entity, with PhraseTrie arrays for the trie backend.
+
+        :param path: Directory path
+        """
+        path = str(path)
+        os.makedirs(path, exist_ok=True)
+        srsly.write_json(os.path.join(path, 'cfg.json'), self._get_cfg())
+        srsly.write_msgpack(os.path.join(path, 'phrases.msgpack'), self._get_phrases())
+        if isinstance(self.phrase_matcher, PhraseTrie):
+            self.phrase_matcher.to_disk(os.path.join(path, 'trie'))
+
+    def from_disk(self, path, exclude=tuple(), **kwargs):
+        """
+        Load the patterns from directory, PhraseTrie arrays are memory-mapped rather than built again.
+
+        :param path: Directory path
+        """
+        path = str(path)
+        cfg = srsly.read_json(os.path.join(path, 'cfg.json'))
+        phrase_matcher = None
+        if cfg.get('phrase_backend') == 'trie' and os.path.exists(os.path.join(path, 'trie')):
+            phrase_matcher = PhraseTrie(self.nlp.vocab).from_disk(os.path.join(path, 'trie'))
+        self._set_cfg(cfg=cfg, phrase_matcher=phrase_matcher)
+        if os.path.exists(os.path.join(path, 'phrases.msgpack')):
+            self._set_phrases(phrases=srsly.read_msgpack(os.path.join(path, 'phrases.msgpack')),
+                              compiled=phrase_matcher is not None)
+        return self
 
     def _filter_spans(self, spans):
         # Filter a sequence of spans so they don't contain overlaps
@@ -82,22 +276,38 @@ class MatcherPipe(object):
         The spacy pipeline caller
         :param doc: The Doc token.
         """
+        return self._set_ents(doc=doc, phrase_matches=self.phrase_matcher(doc))
 
+    def pipe(self, docs: typing.Iterable[Doc], batch_size: int = 1000):
+        """
+        The spacy pipeline caller of nlp.pipe, the phrases are matched in batches, PhraseTrie matches a batch at once
+        :param docs: The docs
+        :param batch_size: Number of docs per batch
+        """
+        for doc, phrase_matches in self.phrase_matcher.pipe(docs, batch_size=batch_size, return_matches=True):
+            yield self._set_ents(doc=doc, phrase_matches=phrase_matches)
+
+    def _set_ents(self, doc: Doc, phrase_matches: list) -> Doc:
         # get matches
-        phrase_matches = self.phrase_matcher(doc)
         matches = self.matcher(doc)
 
         # process them
         spans = []
-        for match_id, start, end in phrase_matches + matches:
+        for match_id, start, end in list(phrase_matches) + matches:
             # start add them into entities list
             span = Span(doc, start, end, label=match_id)
             spans.append(span)
+        if self.regexes:
+            spans.extend(self._regex_text_spans(doc) if self.regex_mode == 'text' else self._regex_token_spans(doc))
         # print('Before', [(ent.label_, ent.text) for ent in doc.ents])
         doc.ents = self._filter_spans(spans + list(doc.ents))
         # print('After', [(ent.label_, ent.text) for ent in doc.ents])
         return doc
 
 
-# add factories
-Language.factories[EXCELCY_MATCHER] = lambda nlp, **cfg: MatcherPipe(nlp, **cfg)
+def create_matcher_pipe(nlp, **cfg):
+    return MatcherPipe(nlp, **cfg)
+
+
+# add factories, it is also registered as "spacy_factories" entry point to be restored by spacy.load
+Language.factories[EXCELCY_MATCHER] = create_matcher_pipe
@@ -5,8 +5,17 @@ import attr
 field = attr.ib
 
 
-@attr.s
 class Registry(object):
+    """
+    Base class for data with attrs, missing attribute returns None. Subclass with @attr.s(slots=True) to keep the
+    fields in __slots__, otherwise it still accepts any attribute.
+    """
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        # attrs generates its own __init__, this is only reached if the subclass missing @attr.s
+        self.__attrs_post_init__()
+
     @classmethod
     def field_names(cls):
         names = [field.name for field in attr.fields(cls)]
@@ -30,15 +39,11 @@ class Registry(object):
         inst = cls(**filtered_items)
         return inst
 
-    def __getattribute__(self, item):
-        try:
-            item = super(Registry, self).__getattribute__(item)
-            return item
-        except AttributeError:
-            return None
-
-    def __setattr__(self, key, value):
-        super(Registry, self).__setattr__(key, value)
+    def __getattr__(self, item):
+        # only called when the normal lookup fails, so the existing attributes have no overhead
+        if item.startswith('__') and item.endswith('__'):
+            raise AttributeError(item)
+        return None
 
     def __attrs_post_init__(self):
         # check whether it is created using @attr.s
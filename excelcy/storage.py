@@ -1,4 +1,4 @@
-import copy
+import array
 import datetime
 import os
 import tempfile
@@ -9,7 +9,7 @@ from excelcy.registry import Registry, field
 from excelcy.utils import odict
 
 
-@attr.s()
+@attr.s(slots=True)
 class BaseItemRegistry(Registry):
     """
     Base class for all item alike data
@@ -40,13 +40,45 @@ class Config(Registry):
     nlp_obj = field(default=None, repr=False)
     nlp_base = field(default=None)  # type: str
     nlp_name = field(default=None)  # type: str
+    nlp_keep_matcher = field(default=False)  # type: bool
+    phase_report = field(default=False)  # type: bool
+    phase_profile = field(default=False)  # type: bool
+    checkpoint_path = field(default=None)  # type: str
+    checkpoint_resume = field(default=False)  # type: bool
     source_language = field(default='en')  # type: str
+    discover_stream = field(default=False)  # type: bool
+    discover_chunk_size = field(default=100000)  # type: int
+    discover_workers = field(default=1)  # type: int
+    discover_executor = field(default='thread')  # type: str
+    discover_min_length = field(default=0)  # type: int
+    discover_max_length = field(default=0)  # type: int
+    discover_dedup = field(default=False)  # type: bool
+    discover_near_dup = field(default=0.0)  # type: float
+    discover_near_dup_perm = field(default=64)  # type: int
+    discover_dedup_size = field(default=1000000)  # type: int
     prepare_enabled = field(default=True)  # type: bool
+    prepare_batch_size = field(default=1000)  # type: int
+    prepare_n_process = field(default=1)  # type: int
+    prepare_phrase_backend = field(default='matcher')  # type: str
+    prepare_phrase_attr = field(default='ORTH')  # type: str
+    prepare_regex_mode = field(default='token')  # type: str
+    prepare_cache = field(default=None)  # type: str
     train_iteration = field(default=None)  # type: int
     train_drop = field(default=None)  # type: float
-
-
-@attr.s()
+    train_batch_size = field(default=1)  # type: int
+    train_batch_size_end = field(default=None)  # type: int
+    train_batch_compound = field(default=1.001)  # type: float
+    train_backend = field(default='registry')  # type: str
+    train_checkpoint_every = field(default=0)  # type: int
+    train_cache = field(default=None)  # type: str
+    train_eval_split = field(default=0.0)  # type: float
+    train_eval_file = field(default=None)  # type: str
+    train_eval_sheet = field(default=None)  # type: str
+    train_patience = field(default=0)  # type: int
+    train_target_score = field(default=None)  # type: float
+
+
+@attr.s(slots=True)
 class Phase(BaseItemRegistry):
     fn = field(default=None)  # type: str
     args = field(default=attr.Factory(odict))  # type: dict
@@ -63,7 +95,7 @@ class Phases(BaseItemListRegistry):
         return item
 
 
-@attr.s()
+@attr.s(slots=True)
 class Source(BaseItemRegistry):
     kind = field(default=None)  # type: str
     value = field(default=None)  # type: str
@@ -78,7 +110,7 @@ class Sources(BaseItemListRegistry):
         return item
 
 
-@attr.s()
+@attr.s(slots=True)
 class Prepare(BaseItemRegistry):
     kind = field(default=None)  # type: str
     value = field(default=None)
@@ -96,21 +128,24 @@ class Prepares(BaseItemListRegistry):
         return item
 
 
-@attr.s()
+@attr.s(slots=True)
 class Gold(BaseItemRegistry):
     subtext = field(default=None)  # type: str
     offset = field(default=None)  # type: str
     entity = field(default=None)  # type: str
 
 
-@attr.s()
+@attr.s(slots=True)
 class Train(BaseItemRegistry):
     text = field(default=None)  # type: str
+    source = field(default=None)  # type: str
     items = field(default=attr.Factory(odict))  # type: typing.Dict[str, Gold]
 
-    def add(self, subtext: str, entity: str, offset: str = None, idx: str = None):
+    def add(self, subtext: str, entity: str, offset: str = None, idx: str = None, enabled: bool = True,
+            notes: str = None):
         item = Gold()
         item.subtext, item.offset, item.entity, item.idx = subtext, offset, entity, str(idx)
+        item.enabled, item.notes = enabled, notes
         self.add_item(item=item)
         return item
 
@@ -124,19 +159,225 @@ class Train(BaseItemRegistry):
 class Trains(BaseItemListRegistry):
     items = field(default=attr.Factory(odict))  # type: typing.Dict[str, Train]
 
-    def add(self, text: str, idx: str = None):
+    def add(self, text: str, idx: str = None, source: str = None, enabled: bool = True, notes: str = None):
         item = Train()
-        item.text, item.idx = text, str(idx)
+        item.text, item.idx, item.source, item.enabled, item.notes = text, str(idx), source, enabled, notes
         self.add_item(item=item)
         return item
 
+    def add_gold(self, train_idx: str, subtext: str, entity: str, offset: str = None, idx: str = None,
+                 enabled: bool = True, notes: str = None):
+        return self.items[str(train_idx)].add(subtext=subtext, entity=entity, offset=offset, idx=idx,
+                                              enabled=enabled, notes=notes)
+
+    def clear_golds(self):
+        for _, train in self.items.items():
+            train.items = odict()
+
+    def iter_texts(self) -> typing.Iterator[typing.Tuple[str, str]]:
+        """
+        Iterate train as (idx, text)
+        """
+        for idx, train in self.items.items():
+            yield idx, train.text
+
+    def iter_rows(self) -> typing.Iterator[typing.Tuple[str, str, list]]:
+        """
+        Iterate train as (idx, text, golds), each gold is (idx, subtext, start, end, entity).
+        The start and end are None if the offset is not known.
+        """
+        for idx, train in self.items.items():
+            golds = []
+            for gold_idx, gold in train.items.items():
+                start, end = utils.parse_offset(gold.offset)
+                golds.append((gold_idx, gold.subtext, start, end, gold.entity))
+            yield idx, train.text, golds
+
+    def iter_sources(self) -> typing.Iterator[typing.Optional[str]]:
+        """
+        Iterate the source idx of train, in the same order as iter_rows
+        """
+        for _, train in self.items.items():
+            yield train.source
+
+    def iter_meta(self) -> typing.Iterator[typing.Tuple[tuple, typing.List[tuple]]]:
+        """
+        Iterate (enabled, notes) of train with the list of (enabled, notes) of its golds, in the same order as iter_rows
+        """
+        for _, train in self.items.items():
+            yield (train.enabled, train.notes), [(gold.enabled, gold.notes) for _, gold in train.items.items()]
+
+    def iter_sheet(self, headers: list) -> typing.Iterator[list]:
+        """
+        Iterate train and gold as XLSX rows
+        :param headers: Column names
+        """
+        for _, train in self.items.items():
+            yield [getattr(train, key, None) for key in headers]
+            for _, gold in train.items.items():
+                yield [getattr(gold, key, None) for key in headers]
+
+
+class ColumnarTrains(object):
+    """
+    Alternative storage for train with large corpus, it has the same API as Trains without the Train/Gold objects.
+    Texts are kept in one UTF-8 buffer, golds are kept in typed arrays. The gold without offset is kept as its subtext
+    with -1 offsets, as in Trains it is resolved to all its occurrences in train.
+    """
+
+    def __init__(self):
+        self.idx = []  # type: typing.List[str]
+        self.rows = {}  # type: typing.Dict[str, int]
+        self.buffer = bytearray()
+        self.text_ends = array.array('q')
+        self.gold_rows = array.array('q')
+        self.gold_starts = array.array('q')
+        self.gold_ends = array.array('q')
+        self.gold_entities = array.array('l')
+        self.entities = []  # type: typing.List[str]
+        # only the subtext which can not be taken from the text offsets, e.g. without offset, and the idx which is
+        # not the default
+        self.subtexts = {}  # type: typing.Dict[int, str]
+        self.gold_idx = {}  # type: typing.Dict[int, str]
+        # the source idx of the row, if it is known
+        self.sources = {}  # type: typing.Dict[int, str]
+        # only the enabled and notes which are not the default, per row and per gold position
+        self.enabled, self.notes = {}, {}  # type: typing.Dict[int, bool], typing.Dict[int, str]
+        self.gold_enabled, self.gold_notes = {}, {}  # type: typing.Dict[int, bool], typing.Dict[int, str]
+        self._gold_counts = array.array('q')
+        self._entity_ids = {}  # type: typing.Dict[str, int]
+        self._gold_index = None
+
+    def __len__(self):
+        return len(self.idx)
+
+    def text(self, row: int) -> str:
+        start = self.text_ends[row - 1] if row > 0 else 0
+        return self.buffer[start:self.text_ends[row]].decode('utf-8')
+
+    def add(self, text: str, idx: str = None, source: str = None, enabled: bool = True, notes: str = None) -> str:
+        idx = str(len(self.idx) + 1) if not idx or str(idx) == str(None) else str(idx)
+        if source is not None:
+            self.sources[len(self.idx)] = source
+        if enabled is not True:
+            self.enabled[len(self.idx)] = enabled
+        if notes is not None:
+            self.notes[len(self.idx)] = notes
+        self.rows[idx] = len(self.idx)
+        self.idx.append(idx)
+        self.buffer.extend((text or '').encode('utf-8'))
+        self.text_ends.append(len(self.buffer))
+        self._gold_counts.append(0)
+        return idx
+
+    def add_gold(self, train_idx: str, subtext: str, entity: str, offset: str = None, idx: str = None,
+                 enabled: bool = True, notes: str = None):
+        row = self.rows[str(train_idx)]
+        position = len(self.gold_rows)
+        self._gold_counts[row] += 1
+        if enabled is not True:
+            self.gold_enabled[position] = enabled
+        if notes is not None:
+            self.gold_notes[position] = notes
+        if idx and str(idx) != str(None) and str(idx) != '%s.%s' % (train_idx, self._gold_counts[row]):
+            self.gold_idx[position] = str(idx)
+        start, end = utils.parse_offset(offset)
+        if start is None:
+            start, end = -1, -1
+        if subtext is not None and (start == -1 or self.text(row)[start:end] != subtext):
+            self.subtexts[position] = subtext
+        if entity not in self._entity_ids:
+            self._entity_ids[entity] = len(self.entities)
+            self.entities.append(entity)
+        self.gold_rows.append(row)
+        self.gold_starts.append(start)
+        self.gold_ends.append(end)
+        self.gold_entities.append(self._entity_ids[entity])
+        self._gold_index = None
+
+    def clear_golds(self):
+        for name in ['gold_rows', 'gold_starts', 'gold_ends', 'gold_entities']:
+            setattr(self, name, array.array(getattr(self, name).typecode))
+        self.subtexts, self.gold_idx, self.gold_enabled, self.gold_notes = {}, {}, {}, {}
+        self._gold_counts = array.array('q', [0]) * len(self.idx)
+        self._gold_index = None
+
+    def _get_gold_index(self) -> typing.Tuple[array.array, array.array]:
+        """
+        Group the golds per train row with counting sort, the golds of row are order[ptr[row]:ptr[row + 1]]
+        """
+        if self._gold_index is None:
+            ptr = array.array('q', [0]) * (len(self.idx) + 1)
+            for row in self.gold_rows:
+                ptr[row + 1] += 1
+            for row in range(len(self.idx)):
+                ptr[row + 1] += ptr[row]
+            order, fill = array.array('q', [0]) * len(self.gold_rows), ptr[:-1]
+            for position, row in enumerate(self.gold_rows):
+                order[fill[row]] = position
+                fill[row] += 1
+            self._gold_index = ptr, order
+        return self._gold_index
+
+    def iter_texts(self) -> typing.Iterator[typing.Tuple[str, str]]:
+        for row, idx in enumerate(self.idx):
+            yield idx, self.text(row)
+
+    def iter_rows(self) -> typing.Iterator[typing.Tuple[str, str, list]]:
+        ptr, order = self._get_gold_index()
+        for row, idx in enumerate(self.idx):
+            text = self.text(row)
+            golds = []
+            for n, position in enumerate(order[ptr[row]:ptr[row + 1]], 1):
+                start, end = self.gold_starts[position], self.gold_ends[position]
+                start, end = (None, None) if start == -1 else (start, end)
+                subtext = self.subtexts.get(position, text[start:end] if start is not None else None)
+                gold_idx = self.gold_idx.get(position, '%s.%s' % (idx, n))
+                golds.append((gold_idx, subtext, start, end, self.entities[self.gold_entities[position]]))
+            yield idx, text, golds
+
+    def iter_sources(self) -> typing.Iterator[typing.Optional[str]]:
+        for row in range(len(self.idx)):
+            yield self.sources.get(row)
+
+    def iter_meta(self) -> typing.Iterator[typing.Tuple[tuple, typing.List[tuple]]]:
+        ptr, order = self._get_gold_index()
+        for row in range(len(self.idx)):
+            golds = [(self.gold_enabled.get(position, True), self.gold_notes.get(position))
+                     for position in order[ptr[row]:ptr[row + 1]]]
+            yield (self.enabled.get(row, True), self.notes.get(row)), golds
+
+    def iter_sheet(self, headers: list) -> typing.Iterator[list]:
+        for row, ((idx, text, golds), (meta, gold_metas)) in enumerate(zip(self.iter_rows(), self.iter_meta())):
+            train = {'idx': idx, 'enabled': meta[0], 'notes': meta[1], 'text': text, 'source': self.sources.get(row)}
+            yield [train.get(key) for key in headers]
+            for (gold_idx, subtext, start, end, entity), gold_meta in zip(golds, gold_metas):
+                gold = {'idx': gold_idx, 'enabled': gold_meta[0], 'notes': gold_meta[1], 'subtext': subtext,
+                        'entity': entity}
+                yield [gold.get(key) for key in headers]
+
+    def as_dict(self) -> dict:
+        """
+        Same structure as Trains.as_dict
+        """
+        items = odict()
+        for row, ((idx, text, golds), (meta, gold_metas)) in enumerate(zip(self.iter_rows(), self.iter_meta())):
+            train = odict([('idx', idx), ('enabled', meta[0]), ('notes', meta[1]), ('text', text),
+                           ('source', self.sources.get(row)), ('items', odict())])
+            for (gold_idx, subtext, start, end, entity), gold_meta in zip(golds, gold_metas):
+                offset = '%s,%s' % (start, end) if start is not None else None
+                train['items'][gold_idx] = odict([('idx', gold_idx), ('enabled', gold_meta[0]), ('notes', gold_meta[1]),
+                                                  ('subtext', subtext), ('offset', offset), ('entity', entity)])
+            items[idx] = train
+        return odict([('items', items)])
+
 
 @attr.s()
 class Storage(Registry):
     phase = field(default=attr.Factory(Phases))  # type: Phases
     source = field(default=attr.Factory(Sources))  # type: Sources
     prepare = field(default=attr.Factory(Prepares))  # type: Prepares
-    train = field(default=attr.Factory(Trains))  # type: Trains
+    train = field(default=attr.Factory(Trains))  # type: typing.Union[Trains, ColumnarTrains]
     config = field(default=attr.Factory(Config))  # type: Config
 
     def resolve_value(self, value: str):
@@ -168,88 +409,150 @@ class Storage(Registry):
         data = utils.yaml_load(file_path=file_path)
         self.parse(data=data)
 
-    def _load_xlsx(self, file_path: str):
+    def _load_msgpack(self, file_path: str):
         """
-        Data loader for XLSX, this needs to be converted back to YML structure format
-        :param file_path: XLSX file path
+        Data loader for msgpack, the binary format with train in columns
+        :param file_path: msgpack file path
         """
-        wb = utils.excel_load(file_path=file_path)
-        data = odict()
-
-        # TODO: add validator, if wrong data input
-        # TODO: refactor to less hardcoded?
+        data = utils.msgpack_load(file_path=file_path)
+        train = data.pop('train', None)
+        self.parse(data=data)
+        if train:
+            self._load_train_columns(columns=train)
 
-        # parse phase
-        data['phase'] = odict()
-        data['phase']['items'] = odict()
-        for phase in wb.get('phase', []):
-            idx = phase.get('idx', len(data['phase']['items']))
-            args = odict()
-            raws = phase.get('args', '').split(',')
-            for raw in raws:
-                kv = raw.split('=')
-                if len(kv) == 2:
-                    key, value = kv
-                    args[key.strip()] = value.strip()
-            phase['args'] = args
-            data['phase']['items'][str(idx)] = phase
+    def _load_train_columns(self, columns: dict):
+        """
+        Add train and gold from the columns, see _save_train_columns
+        :param columns: Train columns
+        """
+        entities = columns['entities']
+        golds = zip(columns['gold_idx'], columns['gold_subtext'], columns['gold_start'], columns['gold_end'],
+                    columns['gold_entity'])
+        # the source and meta columns are optional, for the files saved before they are added
+        sources = columns.get('source') or [None] * len(columns['idx'])
+        metas = {row: (enabled, notes) for row, enabled, notes in columns.get('meta', [])}
+        gold_metas = {position: (enabled, notes) for position, enabled, notes in columns.get('gold_meta', [])}
+        position = 0
+        rows = zip(columns['idx'], columns['text'], columns['gold_count'], sources)
+        for row, (idx, text, count, source) in enumerate(rows):
+            enabled, notes = metas.get(row, (True, None))
+            self.train.add(text=text, idx=idx, source=source, enabled=enabled, notes=notes)
+            for _ in range(count):
+                gold_idx, subtext, start, end, entity = next(golds)
+                offset = '%s,%s' % (start, end) if start is not None else None
+                enabled, notes = gold_metas.get(position, (True, None))
+                self.train.add_gold(train_idx=idx, subtext=subtext, entity=entities[entity], offset=offset,
+                                    idx=gold_idx, enabled=enabled, notes=notes)
+                position = position + 1
+
+    def load_train(self, file_path: str):
+        """
+        Replace the train with the one in msgpack file, e.g. saved with kind=['train'], the rest is kept
+        :param file_path: msgpack file path
+        """
+        data = utils.msgpack_load(file_path=file_path)
+        self.train = type(self.train)()
+        if data.get('train'):
+            self._load_train_columns(columns=data['train'])
 
-        # parse source
-        data['source'] = odict()
-        data['source']['items'] = odict()
-        for source in wb.get('source', []):
-            idx = source.get('idx', len(data['source']['items']))
-            data['source']['items'][str(idx)] = source
+    def load_train_sheet(self, file_path: str, name: str):
+        """
+        Load other sheet of the storage file in the train sheet format, e.g. the held-out train, the storage is kept.
+        It is the sheet in XLSX, or the top level key in YML and msgpack, in the same format as train.
 
-        # parse prepare
-        data['prepare'] = odict()
-        data['prepare']['items'] = odict()
-        for prepare in wb.get('prepare', []):
-            idx = prepare.get('idx', len(data['prepare']['items']))
-            data['prepare']['items'][str(idx)] = prepare
+        :param file_path: Storage file path
+        :param name: Sheet name
+        :return: The train
+        """
+        storage = type(self)()
+        storage.config = self.config
+        storage.train = type(self.train)()
+        file_ext = os.path.splitext(file_path)[1]
+        if file_ext == '.xlsx':
+            with utils.excel_open(file_path=file_path) as wb:
+                storage._load_xlsx_train(rows=utils.excel_iter(wb=wb, name=name))
+        elif file_ext == '.msgpack':
+            columns = utils.msgpack_load(file_path=file_path).get(name)
+            if columns:
+                storage._load_train_columns(columns=columns)
+        else:
+            data = utils.yaml_load(file_path=file_path)
+            storage.parse(data=odict([('config', data.get('config') or {}), ('train', data.get(name) or {})]))
+        return storage.train
 
-        # parse train
-        data['train'] = odict()
-        data['train']['items'] = odict()
+    def _load_xlsx(self, file_path: str):
+        """
+        Data loader for XLSX, this needs to be converted back to YML structure format.
+        The sheets are read lazily, train sheet is streamed into the storage without building the data.
+        :param file_path: XLSX file path
+        """
+        with utils.excel_open(file_path=file_path) as wb:
+            data = odict()
+
+            # TODO: add validator, if wrong data input
+            # TODO: refactor to less hardcoded?
+
+            # parse phase
+            data['phase'] = odict()
+            data['phase']['items'] = odict()
+            for phase in utils.excel_iter(wb=wb, name='phase'):
+                idx = phase.get('idx', len(data['phase']['items']))
+                args = odict()
+                raws = phase.get('args', '').split(',')
+                for raw in raws:
+                    kv = raw.split('=')
+                    if len(kv) == 2:
+                        key, value = kv
+                        args[key.strip()] = value.strip()
+                phase['args'] = args
+                data['phase']['items'][str(idx)] = phase
+
+            # parse source
+            data['source'] = odict()
+            data['source']['items'] = odict()
+            for source in utils.excel_iter(wb=wb, name='source'):
+                idx = source.get('idx', len(data['source']['items']))
+                data['source']['items'][str(idx)] = source
+
+            # parse prepare
+            data['prepare'] = odict()
+            data['prepare']['items'] = odict()
+            for prepare in utils.excel_iter(wb=wb, name='prepare'):
+                idx = prepare.get('idx', len(data['prepare']['items']))
+                data['prepare']['items'][str(idx)] = prepare
+
+            # parse config
+            data['config'] = odict()
+            for config in utils.excel_iter(wb=wb, name='config'):
+                name, value = config.get('name'), config.get('value')
+                data['config'][name] = value
+
+            # everything but train, it also decides the train backend
+            self.parse(data=data)
+
+            # parse train, in single pass
+            self._load_xlsx_train(rows=utils.excel_iter(wb=wb, name='train'))
+
+    def _load_xlsx_train(self, rows: typing.Iterable[dict]):
+        """
+        Add train and gold from the train sheet rows, text row is train and the rows after are its golds.
+        :param rows: Train sheet rows
+        """
         # lets ensure there is idx
         train_idx, gold_idx = 0, 0
-        for train in wb.get('train', []):
-            if train.get('text') is not None:
+        for row in rows:
+            if row.get('text') is not None:
                 if gold_idx > 0:
                     train_idx = train_idx + 1
                     gold_idx = 0
-                if train.get('idx') is None:
-                    train['idx'] = str(train_idx)
+                self.train.add(text=row.get('text'), idx=str(row.get('idx', train_idx)), source=row.get('source'),
+                               enabled=row.get('enabled', True), notes=row.get('notes'))
             else:
-                if train.get('idx') is None:
-                    train['idx'] = '%s.%s' % (train_idx, gold_idx)
+                idx = str(row.get('idx', '%s.%s' % (train_idx, gold_idx)))
                 gold_idx = gold_idx + 1
-        for train in wb.get('train', []):
-            idx = str(train.get('idx'))
-            train_idx, gold_idx = idx, None
-            if '.' in idx:
-                train_idx, gold_idx = idx.split('.')
-            # add train list
-            if train.get('text') is not None:
-                t = odict()
-                t['items'] = odict()
-                for k in ['idx', 'text']:
-                    t[k] = train.get(k)
-                data['train']['items'][train_idx] = t
-            else:
-                t = data['train']['items'][train_idx]
-                g = odict()
-                for k in ['idx', 'subtext', 'offset', 'entity']:
-                    g[k] = train.get(k)
-                t['items'][idx] = g
-
-        # parse config
-        data['config'] = odict()
-        for config in wb.get('config', odict()):
-            name, value = config.get('name'), config.get('value')
-            data['config'][name] = value
-
-        self.parse(data=data)
+                self.train.add_gold(train_idx=idx.split('.')[0], subtext=row.get('subtext'),
+                                    entity=row.get('entity'), offset=row.get('offset'), idx=idx,
+                                    enabled=row.get('enabled', True), notes=row.get('notes'))
 
     def load(self, file_path: str):
         """
@@ -285,6 +588,45 @@ class Storage(Registry):
                 del data[name]
         utils.yaml_save(file_path=file_path, data=data)
 
+    def _save_msgpack(self, file_path: str, kind: list):
+        data = odict()
+        for name in kind:
+            if name == 'train':
+                data[name] = self._save_train_columns()
+            else:
+                data[name] = getattr(self, name).as_dict()
+        utils.msgpack_save(file_path=file_path, data=data)
+
+    def _save_train_columns(self) -> dict:
+        """
+        Train in columns rather than item per train and gold, the golds are flatten in train order and
+        gold_count is number of golds for each train. The entity is index of entities.
+        The enabled and notes are sparse, meta and gold_meta have [row, enabled, notes] only if not the default.
+        """
+        columns = odict((name, []) for name in [
+            'idx', 'text', 'source', 'gold_count', 'gold_idx', 'gold_subtext', 'gold_start', 'gold_end', 'gold_entity',
+            'meta', 'gold_meta'
+        ])
+        entities = odict()
+        rows = zip(self.train.iter_rows(), self.train.iter_sources(), self.train.iter_meta())
+        for row, ((idx, text, golds), source, (meta, gold_metas)) in enumerate(rows):
+            columns['idx'].append(idx)
+            columns['text'].append(text)
+            columns['source'].append(source)
+            columns['gold_count'].append(len(golds))
+            if meta != (True, None):
+                columns['meta'].append([row] + list(meta))
+            for (gold_idx, subtext, start, end, entity), gold_meta in zip(golds, gold_metas):
+                if gold_meta != (True, None):
+                    columns['gold_meta'].append([len(columns['gold_idx'])] + list(gold_meta))
+                columns['gold_idx'].append(gold_idx)
+                columns['gold_subtext'].append(subtext)
+                columns['gold_start'].append(start)
+                columns['gold_end'].append(end)
+                columns['gold_entity'].append(entities.setdefault(entity, len(entities)))
+        columns['entities'] = list(entities.keys())
+        return columns
+
     def _save_xlsx(self, file_path: str, kind: list):
         def convert(header: list, registry: Registry) -> list:
             return [getattr(registry, key, None) for key in header]
@@ -317,12 +659,9 @@ class Storage(Registry):
 
         # build train sheet
         if 'train' in kind:
-            headers = ['idx', 'enabled', 'text', 'subtext', 'entity', 'notes']
+            headers = ['idx', 'enabled', 'text', 'subtext', 'entity', 'source', 'notes']
             sheets['train'] = [headers]
-            for _, train in self.train.items.items():
-                sheets['train'].append(convert(sheets['train'][0], train))
-                for _, gold in train.items.items():
-                    sheets['train'].append(convert(sheets['train'][0], gold))
+            sheets['train'].extend(self.train.iter_sheet(headers=headers))
 
         # build config sheet
         if 'config' in kind:
@@ -334,6 +673,12 @@ class Storage(Registry):
         # save
         utils.excel_save(sheets=sheets, file_path=file_path)
 
+    def as_dict(self) -> dict:
+        data = super(Storage, self).as_dict()
+        if isinstance(self.train, ColumnarTrains):
+            data['train'] = self.train.as_dict()
+        return data
+
     def save(self, file_path: str, kind: list = None):
         kind = kind or ['phase', 'source', 'prepare', 'train', 'config']
         file_name, file_ext = os.path.splitext(file_path)
@@ -347,16 +692,15 @@ class Storage(Registry):
         :param data: Data in ordereddict
         """
 
-        # copy the data
-        data = copy.deepcopy(data)
+        # the objects are built straight from the data, nothing in it is modified, nor copied
+        # parse config first, it decides the train backend
+        self.config = Config.make(items=data.get('config', {}))
 
         # parse phase
         self.phase = Phases()
         for idx, item in data.get('phase', {}).get('items', {}).items():
-            args = item.get('args', odict())
-            for key, val in args.items():
-                args[key] = self.resolve_value(value=val)
             phase = Phase.make(items=item)
+            phase.args = odict((key, self.resolve_value(value=val)) for key, val in (item.get('args') or {}).items())
             self.phase.add_item(item=phase)
 
         # parse source
@@ -372,13 +716,24 @@ class Storage(Registry):
             self.prepare.add_item(item=prepare)
 
         # parse train
-        self.train = Trains()
-        for idx, train_item in data.get('train', {}).get('items', {}).items():
-            train = Train.make(items=train_item)
-            self.train.add_item(item=train)
-            for idx2, gold_item in train_item.get('items', {}).items():
-                gold = Gold.make(items=gold_item)
-                train.add_item(item=gold)
-
-        # parse config
-        self.config = Config.make(items=data.get('config', {}))
+        if self.config.train_backend == 'columnar':
+            self.train = ColumnarTrains()
+            for idx, train_item in data.get('train', {}).get('items', {}).items():
+                train_idx = self.train.add(text=train_item.get('text'), idx=train_item.get('idx'),
+                                           source=train_item.get('source'), enabled=train_item.get('enabled', True),
+                                           notes=train_item.get('notes'))
+                for idx2, gold_item in train_item.get('items', {}).items():
+                    self.train.add_gold(train_idx=train_idx, subtext=gold_item.get('subtext'),
+                                        entity=gold_item.get('entity'), offset=gold_item.get('offset'),
+                                        idx=gold_item.get('idx'), enabled=gold_item.get('enabled', True),
+                                        notes=gold_item.get('notes'))
+        else:
+            self.train = Trains()
+            for idx, train_item in data.get('train', {}).get('items', {}).items():
+                train = Train.make(items=train_item)
+                # the golds are added into new registry rather than the given one
+                train.items = odict()
+                self.train.add_item(item=train)
+                for idx2, gold_item in train_item.get('items', {}).items():
+                    gold = Gold.make(items=gold_item)
+                    train.add_item(item=gold)
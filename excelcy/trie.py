@@ -0,0 +1,314 @@
+import itertools
+import json
+import logging
+import os
+import typing
+import numpy
+import srsly
+from spacy.attrs import IDS
+from spacy.tokens.doc import Doc
+
+logger = logging.getLogger(__name__)
+
+# multiplier of the token n-gram hash, the 64 bits FNV prime
+HASH_PRIME_INT = 1099511628211
+HASH_PRIME = numpy.uint64(HASH_PRIME_INT)
+HASH_MASK = (1 << 64) - 1
+
+
+class PhraseTrie(object):
+    arrays = ['keys', 'labels', 'offsets', 'tokens']
+
+    def __init__(self, vocab, attr: str = 'ORTH'):
+        """
+        Phrase index over token attribute, each phrase is keyed by the hash of its token attribute n-gram.
+        It has the same API as PhraseMatcher, but the index is kept in flat arrays, which can be saved and
+        memory-mapped back. The arrays per phrase, sorted by keys:
+        - keys: hash of the phrase tokens
+        - labels: label index of the phrase, the phrase with many labels has one entry per label
+        - offsets: tokens of the phrase are in tokens[offsets[i]:offsets[i + 1]]
+        - tokens: token attribute hash of the phrases
+
+        A doc is matched with numpy, the hashes of all n-grams are calculated for each phrase length at once,
+        searched in the keys and the hits are verified with the phrase tokens, there is no loop per token.
+
+        :param vocab: The vocab object
+        :param attr: Token attribute to match, e.g. ORTH, LOWER or NORM
+        """
+        self.vocab = vocab
+        self.attr = attr.upper()
+        self.label_names = []  # type: typing.List[str]
+        self.label_ids = []  # type: typing.List[int]
+        self.data = None  # type: typing.Dict[str, numpy.ndarray]
+        # phrase with more than one label as (text, labels), see _freeze
+        self.conflicts = []  # type: typing.List[typing.Tuple[str, typing.List[str]]]
+        # the phrases added since the last match, they are merged into the arrays on the next match
+        self._added = []  # type: typing.List[typing.Tuple[int, numpy.ndarray]]
+        self._lengths = None  # type: typing.List[int]
+        self._bitmap = None  # type: numpy.ndarray
+        self.bitmap_bytes = None  # type: bytes
+
+    def __len__(self):
+        return len(self.label_names)
+
+    def __contains__(self, key: str):
+        return key in self.label_names
+
+    def add(self, key: str, on_match, *docs: Doc):
+        """
+        Add phrases with the same signature as PhraseMatcher.add, on_match is not supported.
+
+        :param key: Match key, e.g. Entity
+        :param on_match: Not used
+        :param docs: Phrase docs
+        """
+        if key not in self.label_names:
+            self.label_names.append(key)
+            self.label_ids.append(self.vocab.strings.add(key))
+        label = self.label_names.index(key)
+        self._added.extend([(label, self._values(doc=doc)) for doc in docs if len(doc) > 0])
+
+    def _values(self, doc: Doc) -> numpy.ndarray:
+        return numpy.asarray(doc.to_array([IDS[self.attr]]).ravel(), dtype=numpy.uint64)
+
+    @staticmethod
+    def _hash(tokens: numpy.ndarray, offsets: numpy.ndarray) -> numpy.ndarray:
+        """
+        Hash of each phrase tokens[offsets[i]:offsets[i + 1]], the same as the n-gram hashes in __call__
+        """
+        lengths = numpy.diff(offsets)
+        keys = numpy.zeros(len(lengths), dtype=numpy.uint64)
+        for size in range(1, int(lengths.max()) + 1 if len(lengths) else 1):
+            mask = lengths >= size
+            keys[mask] = (keys[mask] ^ tokens[offsets[:-1][mask] + size - 1]) * HASH_PRIME
+        return keys
+
+    def _freeze(self):
+        """
+        Merge the added phrases into the sorted arrays, the same phrase and label is kept once
+        """
+        labels = [self.data['labels']] if self.data is not None else []
+        offsets = [self.data['offsets'][1:]] if self.data is not None else []
+        tokens = [self.data['tokens']] if self.data is not None else []
+        end = int(self.data['offsets'][-1]) if self.data is not None else 0
+        if self._added:
+            labels.append(numpy.array([label for label, _ in self._added], dtype=numpy.int64))
+            lengths = numpy.array([len(values) for _, values in self._added], dtype=numpy.int64)
+            offsets.append(end + numpy.cumsum(lengths))
+            tokens.append(numpy.concatenate([values for _, values in self._added]))
+        labels = numpy.concatenate(labels) if labels else numpy.zeros(0, dtype=numpy.int64)
+        offsets = numpy.concatenate([numpy.zeros(1, dtype=numpy.int64)] + offsets)
+        tokens = numpy.concatenate(tokens) if tokens else numpy.zeros(0, dtype=numpy.uint64)
+        keys = self._hash(tokens=tokens, offsets=offsets)
+
+        # sort by key and label, the same phrase is next to each other, the tokens are compared only on the same key
+        order = numpy.lexsort((labels, keys))
+        keys, labels, starts, ends = keys[order], labels[order], offsets[:-1][order], offsets[1:][order]
+        same = numpy.zeros(len(keys), dtype=bool)
+        for i in (numpy.flatnonzero(keys[1:] == keys[:-1]) + 1).tolist():
+            same[i] = numpy.array_equal(tokens[starts[i]:ends[i]], tokens[starts[i - 1]:ends[i - 1]])
+        keep = ~(same & numpy.concatenate([[False], labels[1:] == labels[:-1]]))
+        keys, labels, starts, ends, same = keys[keep], labels[keep], starts[keep], ends[keep], same[keep]
+
+        lengths = ends - starts
+        offsets = numpy.concatenate([numpy.zeros(1, dtype=numpy.int64), numpy.cumsum(lengths)])
+        tokens = tokens[numpy.arange(offsets[-1]) + numpy.repeat(starts - offsets[:-1], lengths)]
+        self.data = {'keys': keys, 'labels': labels, 'offsets': offsets, 'tokens': tokens}
+        self._added, self._lengths, self._bitmap = [], None, None
+        self._report_conflicts(same=same)
+
+    def _report_conflicts(self, same: numpy.ndarray):
+        """
+        Collect the phrases with more than one label, all the labels are matched as PhraseMatcher does
+        :param same: Whether each phrase in the arrays is the same as the previous one
+        """
+        labels, offsets, tokens = self.data['labels'], self.data['offsets'], self.data['tokens']
+        self.conflicts = []
+        for i in numpy.flatnonzero(same).tolist():
+            if same[i - 1]:
+                self.conflicts[-1][1].append(self.label_names[labels[i]])
+                continue
+            values = tokens[offsets[i]:offsets[i + 1]].tolist()
+            text = ' '.join([self.vocab.strings[value] if value in self.vocab.strings else '?' for value in values])
+            self.conflicts.append((text, [self.label_names[labels[i - 1]], self.label_names[labels[i]]]))
+        if self.conflicts:
+            logger.warning('Phrase trie: %s phrases have more than one label, e.g. %s', len(self.conflicts),
+                           ', '.join(['"%s" %s' % (text, labels) for text, labels in self.conflicts[:5]]))
+
+    @property
+    def lengths(self) -> typing.List[int]:
+        """
+        Distinct number of tokens of the phrases, sorted
+        """
+        if self._lengths is None:
+            self._lengths = numpy.unique(numpy.diff(self.data['offsets'])).tolist()
+        return self._lengths
+
+    @property
+    def bitmap(self) -> numpy.ndarray:
+        """
+        Whether any key has the low bits, the size is the power of 2 of 16 times the keys, at most 2^26.
+        It is a view of bitmap_bytes, which is faster to index with python int.
+        """
+        if self._bitmap is None:
+            size = 1 << min(max(int(len(self.data['keys']) * 16).bit_length(), 10), 26)
+            bitmap = numpy.zeros(size, dtype=bool)
+            bitmap[self.data['keys'] & numpy.uint64(size - 1)] = True
+            self.bitmap_bytes = bitmap.tobytes()
+            self._bitmap = numpy.frombuffer(self.bitmap_bytes, dtype=bool)
+        return self._bitmap
+
+    def __call__(self, doc: Doc) -> typing.List[typing.Tuple[int, int, int]]:
+        """
+        Find all phrases in the doc, including the overlapped ones
+
+        :param doc: The Doc token
+        :return: List of (match_id, start, end) as in PhraseMatcher
+        """
+        if self._added or self.data is None:
+            self._freeze()
+        keys, labels, offsets, tokens = [self.data[name] for name in self.arrays]
+        if not len(keys):
+            return []
+        # one doc is too small to pay the numpy call per n-gram length, the n-grams are hashed in python
+        values = self._values(doc=doc).tolist()
+        mask = len(self.bitmap) - 1
+        lengths, bitmap = self.lengths, self.bitmap_bytes
+        matches = []
+        for start in range(len(values)):
+            value = 0
+            for size in range(1, min(lengths[-1], len(values) - start) + 1):
+                value = ((value ^ values[start + size - 1]) * HASH_PRIME_INT) & HASH_MASK
+                if not bitmap[value & mask] or size not in lengths:
+                    continue
+                idx = int(keys.searchsorted(numpy.uint64(value)))
+                while idx < len(keys) and int(keys[idx]) == value:
+                    if offsets[idx + 1] - offsets[idx] == size and \
+                            tokens[offsets[idx]:offsets[idx + 1]].tolist() == values[start:start + size]:
+                        matches.append((self.label_ids[labels[idx]], start, start + size))
+                    idx = idx + 1
+        return matches
+
+    def pipe(self, stream: typing.Iterable[Doc], batch_size: int = 1000, return_matches: bool = False):
+        """
+        Match a stream of docs as PhraseMatcher.pipe, the docs are matched in batches, see match
+
+        :param stream: The docs
+        :param batch_size: Number of docs per batch
+        :param return_matches: Yield (doc, matches) rather than the doc
+        """
+        batch = []
+        for doc in itertools.chain(stream, [None]):
+            if doc is not None:
+                batch.append(doc)
+            if batch and (doc is None or len(batch) >= batch_size):
+                for doc_matches in zip(batch, self.match(docs=batch)):
+                    yield doc_matches if return_matches else doc_matches[0]
+                batch = []
+
+    def match(self, docs: typing.List[Doc]) -> typing.List[typing.List[typing.Tuple[int, int, int]]]:
+        """
+        Find all phrases in the docs at once. The token values of the docs are concatenated, the n-gram hashes of each
+        phrase length are searched in the keys, and the candidates are verified with the phrase tokens.
+
+        :param docs: The docs
+        :return: Matches per doc, list of (match_id, start, end) as in PhraseMatcher
+        """
+        if self._added or self.data is None:
+            self._freeze()
+        keys, labels, offsets, tokens = [self.data[name] for name in self.arrays]
+        matches = [[] for _ in docs]
+        sizes = [len(doc) for doc in docs]
+        if not len(keys) or not sum(sizes):
+            return matches
+        values = numpy.concatenate([self._values(doc=doc) for doc in docs if len(doc)])
+        doc_ids = numpy.repeat(numpy.arange(len(docs)), sizes)
+        doc_starts = numpy.array(list(itertools.accumulate([0] + sizes[:-1])))
+
+        found = []
+        hashes = numpy.zeros(len(values), dtype=numpy.uint64)
+        lengths, bitmap = self.lengths, self.bitmap
+        mask = numpy.uint64(len(bitmap) - 1)
+        for size in range(1, min(lengths[-1], len(values)) + 1):
+            # hashes[start] is the hash of the n-gram values[start:start + size]
+            hashes = (hashes[:len(values) - size + 1] ^ values[size - 1:]) * HASH_PRIME
+            if size not in lengths:
+                continue
+            # the bitmap of the key low bits filters most n-grams out before they are searched
+            starts = bitmap[hashes & mask].nonzero()[0]
+            if len(docs) > 1:
+                starts = starts[doc_ids[starts] == doc_ids[starts + size - 1]]
+            lefts = keys.searchsorted(hashes[starts])
+            hit = keys[numpy.minimum(lefts, len(keys) - 1)] == hashes[starts]
+            starts, lefts = starts[hit], lefts[hit]
+            if not len(starts):
+                continue
+            # the phrase with many labels has one entry per label, all of them are candidates
+            counts = keys.searchsorted(hashes[starts], side='right') - lefts
+            starts = numpy.repeat(starts, counts)
+            idx = numpy.repeat(lefts - numpy.cumsum(counts) + counts, counts) + numpy.arange(len(starts))
+            steps = numpy.arange(size)
+            ok = (offsets[idx + 1] - offsets[idx] == size)
+            ok[ok] = (tokens[offsets[idx[ok], None] + steps] == values[starts[ok, None] + steps]).all(axis=1)
+            found.append((starts[ok], idx[ok], size))
+
+        label_ids = self.label_ids
+        for starts, idx, size in found:
+            ids = doc_ids[starts]
+            for doc_id, start, label in zip(ids.tolist(), (starts - doc_starts[ids]).tolist(), labels[idx].tolist()):
+                matches[doc_id].append((label_ids[label], start, start + size))
+        return matches
+
+    def to_disk(self, path: str):
+        """
+        Save the arrays into directory, each array as .npy file
+        :param path: Directory path
+        """
+        if self._added or self.data is None:
+            self._freeze()
+        os.makedirs(path, exist_ok=True)
+        for name in self.arrays:
+            # replace the file rather than overwrite, the arrays may be memory-mapped from the same file
+            file_path = os.path.join(path, '%s.npy' % name)
+            with open(file_path + '.tmp', 'wb') as f:
+                numpy.save(f, self.data[name])
+            os.replace(file_path + '.tmp', file_path)
+        with open(os.path.join(path, 'cfg.json'), 'w') as f:
+            json.dump({'attr': self.attr, 'labels': self.label_names}, f)
+
+    def from_disk(self, path: str, mmap: bool = True):
+        """
+        Load the arrays from directory
+        :param path: Directory path
+        :param mmap: Memory-map the arrays rather than read them into memory
+        """
+        with open(os.path.join(path, 'cfg.json'), 'r') as f:
+            cfg = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        data = {name: numpy.load(os.path.join(path, '%s.npy' % name), mmap_mode=mmap_mode) for name in self.arrays}
+        return self._set_data(attr=cfg['attr'], label_names=cfg['labels'], data=data)
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialize the arrays, each array as dtype and its buffer
+        """
+        if self._added or self.data is None:
+            self._freeze()
+        arrays = {name: [str(self.data[name].dtype), self.data[name].tobytes()] for name in self.arrays}
+        return srsly.msgpack_dumps({'attr': self.attr, 'labels': self.label_names, 'arrays': arrays})
+
+    def from_bytes(self, bytes_data: bytes):
+        """
+        Load the arrays from bytes, the arrays are read-only views of the bytes
+        :param bytes_data: The serialized arrays
+        """
+        msg = srsly.msgpack_loads(bytes_data)
+        data = {name: numpy.frombuffer(buffer, dtype=dtype) for name, (dtype, buffer) in msg['arrays'].items()}
+        return self._set_data(attr=msg['attr'], label_names=msg['labels'], data=data)
+
+    def _set_data(self, attr: str, label_names: typing.List[str], data: typing.Dict[str, numpy.ndarray]):
+        self.attr, self.label_names = attr, label_names
+        self.label_ids = [self.vocab.strings.add(label) for label in self.label_names]
+        self.data = data
+        self._added, self._lengths, self._bitmap = [], None, None
+        return self
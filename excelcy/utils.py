@@ -1,35 +1,113 @@
+import collections
+import contextlib
+import functools
+import sys
+import time
+import typing
 from collections import OrderedDict as odict
 
 
-def arrtodict(rows):
-    vals = []
-    header = rows[0] if len(rows) > 0 else []
-    rows = rows[1:]
-    # start populate
-    for y, row in enumerate(rows):
-        val = odict()
-        for x, col in enumerate(row):
-            val[header[x]] = col
-        vals.append(val)
-    return vals
-
-
-def filteritems(items):
-    # remove all empty value in dict
-    new_items = [{k: v for k, v in item.items() if v} for item in items]
-    # remove all empty dict
-    new_items = [item for item in new_items if len(item) > 0]
-    return new_items
-
-
-def excel_load(file_path: str):
-    import pyexcel
-    # load workbook
-    wb = pyexcel.get_book_dict(file_name=file_path)
-    for name, item in wb.items():
-        # ensure from array to odict and filter empty values
-        wb[name] = filteritems(arrtodict(item))
-    return wb
+def parse_bool(value) -> bool:
+    # values from phase args are string
+    if isinstance(value, str):
+        return value.strip().lower() in ['true', 'yes', 'y', '1']
+    return bool(value)
+
+
+def parse_offset(offset) -> typing.Tuple[typing.Optional[int], typing.Optional[int]]:
+    # offset is either "start,end" string or (start, end), returns (None, None) if not valid
+    if isinstance(offset, str):
+        offset = offset.replace(' ', '').split(',')
+    try:
+        start, end = offset
+        return int(start), int(end)
+    except (TypeError, ValueError):
+        return None, None
+
+
+def iter_lines(text: str) -> typing.Iterator[str]:
+    # lazily split text into lines, keeping the line ends and without copying the whole text into a list
+    start = 0
+    while start < len(text):
+        end = text.find('\n', start)
+        end = len(text) if end == -1 else end + 1
+        yield text[start:end]
+        start = end
+
+
+def iter_chunks(lines: typing.Iterable[str], size: int) -> typing.Iterator[str]:
+    """
+    Lazily group lines into paragraph chunks, a chunk ends at blank line or when it reaches the size.
+    :param lines: Iterable of lines, e.g. file object
+    :param size: Maximum characters for each chunk
+    """
+    buffer, length = [], 0
+    for line in lines:
+        # flush the buffer if the line does not fit anymore
+        if buffer and length + len(line) > size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+        # cut very long line on the whitespace, otherwise hard cut
+        while len(line) > size:
+            cut = line.rfind(' ', 0, size) + 1 or size
+            yield line[:cut]
+            line = line[cut:]
+        buffer.append(line)
+        length = length + len(line)
+        # blank line is the paragraph boundary
+        if not line.strip():
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def iter_ordered_map(fn: typing.Callable, items: typing.Iterable, executor, window: int) -> typing.Iterator:
+    """
+    Same as executor.map, the results are in the items order, but only the window of items is submitted ahead
+    :param fn: Function to apply on each item
+    :param items: Iterable of items
+    :param executor: The concurrent.futures executor
+    :param window: Maximum items submitted and not yielded yet
+    """
+    futures = collections.deque()
+    for item in items:
+        futures.append(executor.submit(fn, item))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+@contextlib.contextmanager
+def excel_open(file_path: str):
+    """
+    Open workbook in read-only mode, the rows are read lazily from the file rather than loaded at once.
+    :param file_path: XLSX file path
+    """
+    import openpyxl
+    wb = openpyxl.load_workbook(filename=file_path, read_only=True, data_only=True)
+    try:
+        yield wb
+    finally:
+        wb.close()
+
+
+def excel_iter(wb, name: str) -> typing.Iterator[odict]:
+    """
+    Lazily iterate the sheet rows as odict by the header row, one row in memory at a time. The columns without header
+    and the empty values, None or '', are left out, but False and 0 are kept. The rows left empty are skipped.
+    :param wb: Workbook from excel_open
+    :param name: Sheet name, nothing is yielded if it does not exist
+    """
+    if name not in wb.sheetnames:
+        return
+    rows = wb[name].iter_rows(values_only=True)
+    header = next(rows, ())
+    for row in rows:
+        item = odict((key, val) for key, val in zip(header, row) if key is not None and val is not None and val != '')
+        if len(item) > 0:
+            yield item
 
 
 def excel_save(sheets, file_path: str):
@@ -37,27 +115,30 @@ def excel_save(sheets, file_path: str):
     pyexcel.save_book_as(bookdict=sheets, dest_file_name=file_path)
 
 
-def yaml_load(file_path: str):
+@functools.lru_cache(maxsize=None)
+def _yaml_loader(base=None):
     import yaml
     from yaml.resolver import BaseResolver
 
-    def ordered_load(stream, loader_cls):
-        class OrderedLoader(loader_cls):
-            pass
+    # the C LibYAML loader if available, it is many times faster than the pure-Python one
+    class OrderedLoader(base or getattr(yaml, 'CSafeLoader', yaml.SafeLoader)):
+        pass
 
-        def construct_mapping(loader, node):
-            loader.flatten_mapping(node)
-            return odict(loader.construct_pairs(node))
+    def construct_mapping(loader, node):
+        loader.flatten_mapping(node)
+        return odict(loader.construct_pairs(node))
 
-        OrderedLoader.add_constructor(BaseResolver.DEFAULT_MAPPING_TAG, construct_mapping)
-        return yaml.load(stream, OrderedLoader)
+    OrderedLoader.add_constructor(BaseResolver.DEFAULT_MAPPING_TAG, construct_mapping)
+    return OrderedLoader
 
-    return ordered_load(open(file_path, 'r'), yaml.SafeLoader)
 
-
-def yaml_save(data, file_path: str):
+@functools.lru_cache(maxsize=None)
+def _yaml_dumper(base=None):
     import yaml
 
+    class OrderedDumper(base or getattr(yaml, 'CSafeDumper', yaml.SafeDumper)):
+        pass
+
     # link: https://stackoverflow.com/a/16782282/469954
     def yaml_represent_odict(dumper, data):
         value = []
@@ -67,5 +148,62 @@ def yaml_save(data, file_path: str):
             value.append((node_key, node_value))
         return yaml.nodes.MappingNode(u'tag:yaml.org,2002:map', value)
 
-    yaml.add_representer(odict, yaml_represent_odict)
-    yaml.dump(data, open(file_path, 'w'))
+    # registered on the subclass only, the global yaml dumper is untouched
+    OrderedDumper.add_representer(odict, yaml_represent_odict)
+    # the safe dumper raises on tuple, it is saved as list which the safe loader reads back, rather than the
+    # !!python/tuple tag of the full dumper, any other python object raises RepresenterError
+    OrderedDumper.add_representer(tuple, lambda dumper, data: dumper.represent_list(data))
+    return OrderedDumper
+
+
+def yaml_load(file_path: str):
+    import yaml
+    with open(file_path, 'r') as f:
+        return yaml.load(f, _yaml_loader())
+
+
+def yaml_save(data, file_path: str):
+    import yaml
+    with open(file_path, 'w') as f:
+        yaml.dump(data, f, Dumper=_yaml_dumper(), default_flow_style=False)
+
+
+def msgpack_load(file_path: str):
+    import srsly
+    return srsly.read_msgpack(file_path)
+
+
+def msgpack_save(data, file_path: str):
+    import srsly
+    srsly.write_msgpack(file_path, data)
+
+
+def json_load(file_path: str):
+    import srsly
+    return srsly.read_json(file_path)
+
+
+def json_save(data, file_path: str):
+    import srsly
+    srsly.write_json(file_path, data)
+
+
+def cpu_time() -> float:
+    # CPU time in seconds of this process and its children which are waited for, e.g. the workers of nlp.pipe
+    try:
+        import resource
+    except ImportError:
+        return time.process_time()
+    usages = [resource.getrusage(who) for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]]
+    return sum(usage.ru_utime + usage.ru_stime for usage in usages)
+
+
+def peak_rss() -> typing.Optional[float]:
+    # peak resident memory of this process in MB since it is started, it is not available on Windows
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # it is in bytes on macOS, otherwise in KB
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
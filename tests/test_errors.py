@@ -13,3 +13,13 @@ class TestErrors(BaseTestCase):
             excelcy.load(file_path='not_exist.xlsx')
 
         assert str(excinfo.value) == Errors.E001
+
+    def test_e002(self):
+        """ Test: Error code E002 """
+
+        with pytest.raises(ValueError) as excinfo:
+            excelcy = ExcelCy()
+            excelcy.storage.config.train_eval_sheet = 'eval'
+            excelcy._train_split(examples=[])
+
+        assert str(excinfo.value) == Errors.E002
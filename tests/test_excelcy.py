@@ -1,4 +1,15 @@
-from excelcy import ExcelCy
+import numpy
+import os
+import pstats
+import srsly
+import subprocess
+import sys
+import time
+from excelcy import ExcelCy, cli, utils
+from excelcy.cache import PrepareCache, nlp_cache
+from excelcy.dedup import MinHashLSH, SentenceFilter
+from excelcy.pipe import EXCELCY_MATCHER
+from excelcy.storage import Config, ColumnarTrains
 from tests.test_base import BaseTestCase
 
 
@@ -31,3 +42,465 @@ class ExcelCyTestCase(BaseTestCase):
         """ Test: executing phases """
 
         self.assert_training(file_path=self.get_test_data_path('test_data_04.xlsx'))
+
+    def test_prepare_batch(self):
+        """ Test: prepare in batches with multiple processes """
+
+        excelcy = ExcelCy()
+        excelcy.storage.config = Config(nlp_base='en_core_web_sm', prepare_batch_size=2, prepare_n_process=2)
+        texts = ['Uber blew through $1 million a week', 'Android Pay expands to Canada', 'Uber steps up Asia expansion']
+        for text in texts:
+            excelcy.storage.train.add(text=text)
+        excelcy.storage.prepare.add(kind='phrase', value='Uber', entity='ORG')
+        excelcy.prepare()
+        for text, (_, train) in zip(texts, excelcy.storage.train.items.items()):
+            assert train.text == text
+            golds = [(gold.subtext, gold.entity) for _, gold in train.items.items()]
+            assert (('Uber', 'ORG') in golds) == text.startswith('Uber')
+
+    def test_prepare_cache(self):
+        """ Test: prepare reuses the cached annotations, only new texts and changed patterns are parsed again """
+
+        def prepare(texts: list, phrases: list) -> ExcelCy:
+            excelcy = ExcelCy()
+            excelcy.storage.base_path = os.path.dirname(cache_path)
+            excelcy.storage.config = Config(nlp_base='en_core_web_sm', prepare_cache=os.path.basename(cache_path))
+            for text in texts:
+                excelcy.storage.train.add(text=text)
+            for phrase in phrases:
+                excelcy.storage.prepare.add(kind='phrase', value=phrase, entity='ORG')
+            excelcy.prepare()
+            return excelcy
+
+        def golds(excelcy: ExcelCy) -> list:
+            return [(idx, subtext, start, end, entity) for _, _, items in excelcy.storage.train.iter_rows()
+                    for idx, subtext, start, end, entity in items]
+
+        cache_path = self.get_test_tmp_path(fs_path='test_prepare_cache.msgpack')
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        texts = ['Uber blew through $1 million a week', 'Android Pay expands to Canada']
+        excelcy = prepare(texts=texts, phrases=['Uber'])
+        assert (excelcy._prepare_cache.hits, excelcy._prepare_cache.misses) == (0, 2)
+        excelcy2 = prepare(texts=texts + ['Uber steps up Asia expansion'], phrases=['Uber'])
+        assert (excelcy2._prepare_cache.hits, excelcy2._prepare_cache.misses) == (2, 1)
+        assert golds(excelcy2)[:len(golds(excelcy))] == golds(excelcy)
+        assert ('Uber', 'ORG') in [(subtext, entity) for _, subtext, _, _, entity in golds(excelcy2)[-1:]]
+        # the patterns are changed
+        excelcy3 = prepare(texts=texts, phrases=['Uber', 'Android Pay'])
+        assert (excelcy3._prepare_cache.hits, excelcy3._prepare_cache.misses) == (0, 2)
+        # the weights are hashed once per pipe, the trained pipe again
+        fingerprint = excelcy3._prepare_cache.fingerprint
+        ner = excelcy3.nlp.get_pipe('ner')
+        assert excelcy3._prepare_cache_open().fingerprint == fingerprint
+        assert PrepareCache.weights[id(ner)][0] is ner
+        excelcy3.storage.config.train_iteration, excelcy3.storage.config.train_drop = 1, 0.2
+        excelcy3.train()
+        assert excelcy3._prepare_cache_open().fingerprint != fingerprint
+
+    def test_nlp_cache(self):
+        """ Test: model is loaded once for the instances, each has its own pipeline and trained pipe """
+
+        def create() -> ExcelCy:
+            excelcy = ExcelCy()
+            excelcy.storage.config = Config(nlp_base='en_core_web_sm', train_iteration=1, train_drop=0.2)
+            excelcy.storage.train.add(text='Uber blew through $1 million a week')
+            return excelcy
+
+        nlp_cache.clear()
+        misses = nlp_cache.misses
+        excelcy, excelcy2 = create(), create()
+        nlp, nlp2 = excelcy.nlp, excelcy2.nlp
+        assert nlp_cache.misses == misses + 1
+        assert nlp is not nlp2 and nlp.get_pipe('ner') is nlp2.get_pipe('ner')
+        excelcy.storage.prepare.add(kind='phrase', value='Uber', entity='ORG')
+        excelcy.prepare()
+        assert EXCELCY_MATCHER in nlp.pipe_names and EXCELCY_MATCHER not in nlp2.pipe_names
+        excelcy.train()
+        assert nlp.get_pipe('ner') is not nlp2.get_pipe('ner')
+        assert nlp2.get_pipe('ner') is nlp_cache.load(name='en_core_web_sm').get_pipe('ner')
+
+    def test_nlp_cache_train(self):
+        """ Test: instances from the same cached model train different labels, only the vocab is shared """
+
+        def train(text: str, subtext: str, entity: str) -> ExcelCy:
+            excelcy = ExcelCy()
+            excelcy.storage.config = Config(nlp_base='en_core_web_sm', train_iteration=1, train_drop=0.2)
+            excelcy.storage.train.add(text=text).add(subtext=subtext, entity=entity)
+            return excelcy.train()
+
+        nlp_cache.clear()
+        base_labels = set(nlp_cache.load(name='en_core_web_sm').get_pipe('ner').labels)
+        excelcy = train(text='I eat a durian every day', subtext='durian', entity='FRUIT')
+        excelcy2 = train(text='She drives a roadster to work', subtext='roadster', entity='CAR')
+        labels, labels2 = set(excelcy.nlp.get_pipe('ner').labels), set(excelcy2.nlp.get_pipe('ner').labels)
+        assert labels - base_labels == {'FRUIT'} and labels2 - base_labels == {'CAR'}
+        assert set(nlp_cache.load(name='en_core_web_sm').get_pipe('ner').labels) == base_labels
+        # the vocab of the cached model is shared
+        assert excelcy.nlp.vocab is excelcy2.nlp.vocab and 'FRUIT' in excelcy2.nlp.vocab.strings
+
+    def test_batch(self):
+        """ Test: execute many storage files in the worker processes with the summary per file """
+
+        storage = ExcelCy().storage
+        storage.config = Config(nlp_base='en_core_web_sm')
+        storage.phase.add(fn='discover')
+        storage.phase.add(fn='prepare')
+        storage.source.add(kind='text', value='Uber blew through $1 million a week. Android Pay expands to Canada.')
+        storage.prepare.add(kind='phrase', value='Uber', entity='ORG')
+        file_paths = [self.get_test_tmp_path(fs_path='test_batch_%s.yml' % i) for i in range(2)]
+        for file_path in file_paths:
+            storage.save(file_path=file_path)
+        missing_path = self.get_test_tmp_path(fs_path='test_batch_missing.yml')
+        summary_path = self.get_test_tmp_path(fs_path='test_batch_summary.json')
+        code = cli.main(['', 'batch', '-w', '2', '-s', summary_path] + file_paths + [missing_path])
+        assert code == 1
+        summaries = srsly.read_json(summary_path)
+        assert [summary['file_path'] for summary in summaries] == file_paths + [missing_path]
+        assert [summary['ok'] for summary in summaries] == [True, True, False]
+        assert [phase['fn'] for phase in summaries[0]['phases']] == ['discover', 'prepare']
+        assert summaries[2]['error']
+
+    def test_phase_report(self):
+        """ Test: phase timings, items and profiles are saved next to the storage file """
+
+        storage = ExcelCy().storage
+        storage.config = Config(nlp_base='en_core_web_sm', phase_report=True)
+        storage.phase.add(fn='discover')
+        storage.phase.add(fn='prepare')
+        storage.source.add(kind='text', value='Uber blew through $1 million a week. Android Pay expands to Canada.')
+        storage.prepare.add(kind='phrase', value='Uber', entity='ORG')
+        file_path = self.get_test_tmp_path(fs_path='test_phase_report.yml')
+        storage.save(file_path=file_path)
+        excelcy = cli.execute(file_path=file_path, profile=True)
+        report = srsly.read_json(self.get_test_tmp_path(fs_path='test_phase_report.report.json'))
+        assert [phase['profile'] for phase in report['phases']] == [stat['profile'] for stat in excelcy.phase_stats]
+        assert [(phase['fn'], phase['ok'], phase['items']) for phase in report['phases']] == [
+            ('discover', True, 2), ('prepare', True, 2)]
+        for phase in report['phases']:
+            assert phase['seconds'] >= 0 and phase['cpu_seconds'] >= 0 and phase['process_peak_rss_mb'] > 0
+            assert phase['peak_rss_delta_mb'] >= 0
+            assert pstats.Stats(phase['profile']).total_calls > 0
+
+        # the CPU time of the worker processes is counted once they are waited for
+        cpu_start, process_start = utils.cpu_time(), time.process_time()
+        subprocess.run([sys.executable, '-c', 'sum(range(10 ** 7))'], check=True)
+        assert utils.cpu_time() - cpu_start > time.process_time() - process_start
+
+    def test_checkpoint_resume(self):
+        """ Test: resume skips the phases done and continues train from its last checkpoint """
+
+        storage = ExcelCy().storage
+        storage.config = Config(nlp_base='en_core_web_sm', train_iteration=3, train_drop=0.2, train_checkpoint_every=1,
+                                checkpoint_path='test_checkpoint', train_eval_sheet='eval')
+        for fn in ['discover', 'prepare', 'train']:
+            storage.phase.add(fn=fn)
+        storage.source.add(kind='text', value='Uber blew through $1 million a week. Android Pay expands to Canada.')
+        storage.prepare.add(kind='phrase', value='Uber', entity='ORG')
+        file_path = self.get_test_tmp_path(fs_path='test_checkpoint.yml')
+        storage.save(file_path=file_path)
+        # the held-out train in other sheet of the same file
+        eval_storage = ExcelCy().storage
+        eval_storage.train.add(text='Uber steps up Asia expansion').add(subtext='Uber', entity='ORG')
+        data = utils.yaml_load(file_path=file_path)
+        data['eval'] = eval_storage.train.as_dict()
+        utils.yaml_save(file_path=file_path, data=data)
+
+        # preempted after the train checkpoint at iteration 2
+        excelcy = ExcelCy()
+        checkpoint_train = excelcy._checkpoint_train
+
+        checkpoint_path = self.get_test_tmp_path(fs_path='test_checkpoint')
+
+        def preempt(ner, iteration: int, best: tuple):
+            checkpoint_train(ner=ner, iteration=iteration, best=best)
+            if iteration == 2:
+                state = srsly.read_json(os.path.join(checkpoint_path, 'state.json'))
+                assert state['train_best'] == list(best[:2])
+                assert os.path.exists(os.path.join(checkpoint_path, 'ner.2', 'best.bin'))
+                raise KeyboardInterrupt()
+
+        excelcy._checkpoint_train = preempt
+        with self.assertRaises(KeyboardInterrupt):
+            cli.execute(file_path=file_path, excelcy=excelcy)
+        assert [(stat['fn'], stat['ok']) for stat in excelcy.phase_stats] == [
+            ('discover', True), ('prepare', True), ('train', False)]
+
+        excelcy2 = cli.execute(file_path=file_path, resume=True)
+        assert [(stat['fn'], stat['ok']) for stat in excelcy2.phase_stats] == [('train', True)]
+        assert [stat['iteration'] for stat in excelcy2.train_stats] == [1, 2, 3]
+        # the best so far is restored with the train checkpoint
+        scores = [stat['eval']['f'] for stat in excelcy2.train_stats]
+        assert [stat['best'] for stat in excelcy2.train_stats] == [i == scores.index(max(scores)) for i in range(3)]
+        assert list(excelcy2.storage.train.iter_rows()) == list(excelcy.storage.train.iter_rows())
+        assert EXCELCY_MATCHER in excelcy2.nlp.pipe_names
+        assert sorted(os.listdir(checkpoint_path)) == ['nlp.3', 'state.json', 'train.msgpack']
+
+        # without resume, it starts over
+        excelcy3 = cli.execute(file_path=file_path)
+        assert [stat['fn'] for stat in excelcy3.phase_stats] == ['discover', 'prepare', 'train']
+
+    def test_checkpoint_resume_train(self):
+        """ Test: resume train stopped in the middle, with no phase done before it """
+
+        storage = ExcelCy().storage
+        storage.config = Config(nlp_base='en_core_web_sm', train_iteration=2, train_drop=0.2, train_checkpoint_every=1,
+                                checkpoint_path='test_checkpoint_train')
+        storage.phase.add(fn='train')
+        storage.train.add(text='Uber blew through $1 million a week').add(subtext='Uber', entity='ORG')
+        file_path = self.get_test_tmp_path(fs_path='test_checkpoint_train.yml')
+        storage.save(file_path=file_path)
+
+        excelcy = ExcelCy()
+        checkpoint_train = excelcy._checkpoint_train
+
+        def preempt(ner, iteration: int, best: tuple):
+            checkpoint_train(ner=ner, iteration=iteration, best=best)
+            raise KeyboardInterrupt()
+
+        excelcy._checkpoint_train = preempt
+        with self.assertRaises(KeyboardInterrupt):
+            cli.execute(file_path=file_path, excelcy=excelcy)
+        checkpoint_path = self.get_test_tmp_path(fs_path='test_checkpoint_train')
+        assert 'train.msgpack' not in os.listdir(checkpoint_path)
+
+        excelcy2 = cli.execute(file_path=file_path, resume=True)
+        assert [(stat['fn'], stat['ok']) for stat in excelcy2.phase_stats] == [('train', True)]
+        assert [stat['iteration'] for stat in excelcy2.train_stats] == [1, 2]
+        assert list(excelcy2.storage.train.iter_rows()) == list(excelcy.storage.train.iter_rows())
+
+    def test_discover_stream(self):
+        """ Test: discover sentences in streaming chunks """
+
+        excelcy = ExcelCy()
+        excelcy.storage.base_path = self.test_data_path
+        excelcy.storage.config = Config(nlp_base='en_core_web_sm', discover_stream=True, discover_chunk_size=40)
+        excelcy.storage.source.add(kind='text',
+                                   value='Google rebrands its business apps.\n\nSpotify steps up Asia expansion.')
+        excelcy.storage.source.add(kind='textract', value='source/source_01.txt')
+        excelcy.discover()
+        texts = [train.text for _, train in excelcy.storage.train.items.items()]
+        assert texts == ['Google rebrands its business apps.', 'Spotify steps up Asia expansion.',
+                         'Uber blew through $1 million a week.', 'Android Pay expands to Canada.']
+
+    def test_discover_workers(self):
+        """ Test: textract sources are extracted in the worker pool, the train is in the same order with its source """
+
+        def discover(**kwargs) -> list:
+            excelcy = ExcelCy()
+            excelcy.storage.base_path = self.test_data_path
+            excelcy.storage.config = Config(nlp_base='en_core_web_sm', **kwargs)
+            for i in range(3):
+                excelcy.storage.source.add(kind='textract', value='source/source_01.txt')
+                excelcy.storage.source.add(kind='text', value='Google rebrands its business apps %s.' % i)
+            excelcy.discover()
+            return [(train.text, train.source) for _, train in excelcy.storage.train.items.items()]
+
+        trains = discover(discover_stream=True)
+        assert trains[:3] == [('Uber blew through $1 million a week.', '1'), ('Android Pay expands to Canada.', '1'),
+                              ('Google rebrands its business apps 0.', '2')]
+        assert len(trains) == 9 and trains[-1] == ('Google rebrands its business apps 2.', '6')
+        assert discover(discover_stream=True, discover_workers=2) == trains
+        assert discover(discover_stream=True, discover_workers=2, discover_executor='process') == trains
+        assert discover(discover_workers=2) == discover()
+
+    def test_discover_filter(self):
+        """ Test: discover drops the sentences by length, exact and near duplicate, memory is bounded """
+
+        def discover(**kwargs) -> ExcelCy:
+            excelcy = ExcelCy()
+            excelcy.storage.config = Config(nlp_base='en_core_web_sm', discover_stream=True, **kwargs)
+            excelcy.storage.source.add(kind='text', value=' '.join(texts))
+            excelcy.discover()
+            return excelcy
+
+        texts = ['Uber blew through $1 million a week.', 'Copyright 2019 Example Company, all rights reserved.',
+                 'Ok.', 'Uber blew through $1 million a week.', 'Copyright 2020 Example Company, all rights reserved.',
+                 'Android Pay expands to Canada.']
+        excelcy = discover(discover_min_length=5, discover_dedup=True, discover_near_dup=0.5)
+        assert [text for _, text in excelcy.storage.train.iter_texts()] == [texts[0], texts[1], texts[5]]
+        assert excelcy.discover_stats == {'kept': 3, 'too_short': 1, 'too_long': 0, 'duplicate': 1,
+                                          'near_duplicate': 1}
+        excelcy = discover(discover_max_length=40, discover_dedup=True)
+        assert [text for _, text in excelcy.storage.train.iter_texts()] == [texts[0], texts[2], texts[5]]
+        excelcy = discover()
+        assert excelcy.discover_stats == {} and len(list(excelcy.storage.train.iter_texts())) == len(texts)
+
+        # only the last max_entries / 2 at least are remembered
+        sentence_filter = SentenceFilter(dedup=True, near_dup_threshold=0.9, max_entries=4)
+        assert [sentence_filter.check(text) for text in ['a', 'b', 'c', 'a', 'd', 'e', 'd', 'a']] == [
+            True, True, True, False, True, True, False, True]
+        assert len(sentence_filter._hashes) + len(sentence_filter._previous) <= 4
+        assert sentence_filter.lsh.size <= 2 and sentence_filter.dropped == 2
+
+    def test_near_dup_bucket(self):
+        """ Test: near-duplicate is found when its source is not the first signature of the bucket """
+
+        # 2 bands of 2 rows, b is in the bucket of a in the first band, but it is not near-duplicate of a
+        signatures = {'a': [1, 2, 3, 4], 'b': [1, 2, 5, 6], 'c': [1, 2, 5, 7], 'd': [1, 2, 8, 9]}
+        lsh = MinHashLSH(threshold=0.75, num_perm=4, bucket_size=2)
+        lsh.signature = lambda text: numpy.array(signatures[text], dtype=numpy.uint32)
+        assert (lsh.bands, lsh.rows) == (2, 2)
+        assert [lsh.insert(text=text) for text in ['a', 'b', 'c', 'd']] == [True, True, False, True]
+        # the bucket is capped
+        assert len(lsh.tables[0][lsh.signature('a')[:2].tobytes()]) == 2
+
+    def test_train_batch(self):
+        """ Test: train in compounding minibatches """
+
+        excelcy = ExcelCy()
+        excelcy.storage.config = Config(nlp_base='en_core_web_sm', train_iteration=2, train_drop=0.2,
+                                        train_batch_size=1, train_batch_size_end=4)
+        for text in ['Uber blew through $1 million a week', 'Google rebrands its business apps']:
+            train = excelcy.storage.train.add(text=text)
+            train.add(subtext=text.split(' ')[0], entity='ORG')
+        excelcy.train()
+        assert [stat['iteration'] for stat in excelcy.train_stats] == [1, 2]
+        assert all(stat['examples'] == 2 and stat['loss'] >= 0 for stat in excelcy.train_stats)
+
+    def test_train_offsets(self):
+        """ Test: gold offsets are resolved to all occurrences, the misaligned and overlapping spans are dropped """
+
+        excelcy = ExcelCy()
+        excelcy.storage.config = Config(nlp_base='en_core_web_sm')
+        train = excelcy.storage.train.add(text='Uber and Uber Eats, not Ubers, expand to Canada')
+        train.add(subtext='Uber', entity='ORG')
+        train.add(subtext='Uber Eats', entity='PRODUCT')
+        # only inside the longer subtext
+        train.add(subtext='Eats', entity='PRODUCT')
+        train.add(subtext='Canada', entity='GPE', offset='41,47')
+        train.add(subtext='to Canada', entity='GPE', offset='38,47')
+        train.add(subtext='xpand', entity='ORG', offset='32,37')
+        train.add(subtext='Lyft', entity='ORG')
+        examples, entities = excelcy._train_examples(train=excelcy.storage.train)
+        assert entities == {'ORG', 'PRODUCT', 'GPE'}
+        assert [(doc.text, annotations) for doc, annotations in examples] == [
+            (train.text, {'entities': [(0, 4, 'ORG'), (9, 18, 'PRODUCT'), (38, 47, 'GPE')]})]
+        assert [(issue['subtext'], issue['reason']) for issue in excelcy.train_issues] == [
+            ('Lyft', 'not_found'), ('xpand', 'misaligned'), ('Canada', 'overlap'), ('Eats', 'overlap'),
+            ('Uber', 'misaligned')]
+
+        # resolved once, the same text and golds are taken from the cache
+        excelcy.train_issues = []
+        excelcy._train_resolve = None
+        assert excelcy._train_examples(train=excelcy.storage.train)[0] == examples
+        assert len(excelcy.train_issues) == 5 and excelcy.train_issues[0]['idx'] == str(train.idx)
+
+    def test_train_cache(self):
+        """ Test: train docs are tokenized once and saved, retrain on the same corpus loads them """
+
+        def create() -> ExcelCy:
+            excelcy = ExcelCy()
+            excelcy.storage.base_path = os.path.dirname(cache_path)
+            excelcy.storage.config = Config(nlp_base='en_core_web_sm', train_iteration=2, train_drop=0.2,
+                                            train_cache=os.path.basename(cache_path))
+            for text in texts:
+                train = excelcy.storage.train.add(text=text)
+                train.add(subtext=text.split(' ')[0], entity='ORG')
+            return excelcy
+
+        cache_path = self.get_test_tmp_path(fs_path='test_train_cache.msgpack')
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        texts = ['Uber blew through $1 million a week', 'Google rebrands its business apps']
+        excelcy = create()
+        excelcy.train()
+        assert (excelcy._train_cache.hits, excelcy._train_cache.misses) == (0, 2)
+        examples = excelcy._train_examples(train=excelcy.storage.train)[0]
+        assert excelcy._train_cache.hits == 2
+
+        texts.append('Spotify steps up Asia expansion')
+        excelcy2 = create()
+        excelcy2.train()
+        assert (excelcy2._train_cache.hits, excelcy2._train_cache.misses) == (2, 1)
+        examples2 = excelcy2._train_examples(train=excelcy2.storage.train)[0]
+        assert [([token.text for token in doc], annotations) for doc, annotations in examples2[:2]] == [
+            ([token.text for token in doc], annotations) for doc, annotations in examples]
+
+    def test_train_early_stop(self):
+        """ Test: train scores the held-out after each iteration, stops early and keeps the best iteration """
+
+        def create(**kwargs) -> ExcelCy:
+            excelcy = ExcelCy()
+            excelcy.storage.base_path = self.test_data_path
+            excelcy.storage.config = Config(nlp_base='en_core_web_sm', train_iteration=10, train_drop=0.2, **kwargs)
+            for i, name in enumerate(companies):
+                train = excelcy.storage.train.add(text='%s announces the results of quarter %s' % (name, i))
+                train.add(subtext=name, entity='ORG')
+            return excelcy
+
+        companies = ['Uber', 'Google', 'Spotify', 'Android', 'Apple', 'Amazon', 'Netflix', 'Tesla', 'Intel', 'Oracle']
+        excelcy = create(train_eval_split=0.3, train_patience=2)
+        examples, _ = excelcy._train_examples(train=excelcy.storage.train)
+        train_examples, eval_examples = excelcy._train_split(examples=examples)
+        assert len(train_examples) + len(eval_examples) == len(companies) and eval_examples
+        assert excelcy._train_split(examples=list(reversed(examples)))[1] == list(reversed(eval_examples))
+        excelcy.train()
+        stats = excelcy.train_stats
+        assert all(set(stat['eval']) == {'p', 'r', 'f', 'ents_per_type'} for stat in stats)
+        assert all(stat['examples'] == len(train_examples) for stat in stats)
+        best = [stat for stat in stats if stat['best']]
+        assert len(best) == 1 and best[0]['eval']['f'] == max(stat['eval']['f'] for stat in stats)
+        assert len(stats) == 10 or stats[-1]['iteration'] - best[0]['iteration'] == 2
+        with excelcy.nlp.disable_pipes(*[name for name in excelcy.nlp.pipe_names if name != 'ner']):
+            assert excelcy.evaluate(examples=eval_examples)['f'] == best[0]['eval']['f']
+
+        # the dropped spans of the held-out are labelled with the eval split
+        excelcy = create(train_eval_split=0.3)
+        for _, train in excelcy.storage.train.items.items():
+            train.add(subtext='Lyft', entity='ORG')
+        examples, _ = excelcy._train_examples(train=excelcy.storage.train)
+        eval_texts = {doc.text for doc, _ in excelcy._train_split(examples=examples)[1]}
+        texts = dict(excelcy.storage.train.iter_texts())
+        splits = [issue['split'] for issue in excelcy.train_issues]
+        assert splits == ['eval' if texts[issue['idx']] in eval_texts else 'train' for issue in excelcy.train_issues]
+        assert splits.count('eval') == len(eval_texts) and 'train' in splits
+
+        # the held-out from separate storage file, any score reaches the target
+        file_path = self.get_test_tmp_path(fs_path='test_train_eval.yml')
+        eval_storage = ExcelCy().storage
+        eval_train = eval_storage.train.add(text='Intel announces the results')
+        eval_train.add(subtext='Intel', entity='ORG')
+        eval_train.add(subtext='Lyft', entity='ORG')
+        eval_storage.save(file_path=file_path, kind=['train'])
+        excelcy = create(train_eval_file=file_path, train_target_score=0.0)
+        excelcy.train()
+        assert len(excelcy.train_stats) == 1 and excelcy.train_stats[0]['examples'] == len(companies)
+        assert list(excelcy.train_stats[0]['eval']['ents_per_type']) == ['ORG']
+        assert [(issue['subtext'], issue['split']) for issue in excelcy.train_issues] == [('Lyft', 'eval')]
+
+    def test_train_backend_parity(self):
+        """ Test: the same workbook trains the same examples with registry and columnar train storage """
+
+        storage = ExcelCy().storage
+        train = storage.train.add(text='Uber and Uber Eats and Uber again')
+        train.add(subtext='Uber', entity='ORG')
+        train.add(subtext='Uber Eats', entity='PRODUCT')
+        file_path = self.get_test_tmp_path(fs_path='test_train_backend_parity.xlsx')
+        results = []
+        for backend in ['registry', 'columnar']:
+            storage.config = Config(nlp_base='en_core_web_sm', train_backend=backend)
+            storage.save(file_path=file_path)
+            excelcy = ExcelCy().load(file_path=file_path)
+            assert isinstance(excelcy.storage.train, ColumnarTrains) == (backend == 'columnar')
+            examples, _ = excelcy._train_examples(train=excelcy.storage.train)
+            results.append(([annotations for _, annotations in examples], excelcy.storage.train.as_dict()))
+        assert results[0] == results[1]
+        assert results[0][0] == [{'entities': [(0, 4, 'ORG'), (9, 18, 'PRODUCT'), (23, 27, 'ORG')]}]
+        # no offset is made up for the golds without it
+        golds = list(list(results[1][1]['items'].values())[0]['items'].values())
+        assert [(gold['subtext'], gold['offset']) for gold in golds] == [('Uber', None), ('Uber Eats', None)]
+
+    def test_train_columnar(self):
+        """ Test: train and retest with columnar train storage """
+
+        excelcy = ExcelCy()
+        excelcy.storage.config = Config(nlp_base='en_core_web_sm', train_iteration=2, train_drop=0.2)
+        excelcy.storage.train = ColumnarTrains()
+        for text in ['Uber blew through $1 million a week', 'Google rebrands its business apps']:
+            idx = excelcy.storage.train.add(text=text)
+            excelcy.storage.train.add_gold(train_idx=idx, subtext=text.split(' ')[0], entity='ORG')
+        excelcy.train()
+        assert len(excelcy.train_stats) == 2
+        excelcy.retest()
+        assert [text for _, text in excelcy.storage.train.iter_texts()][1] == 'Google rebrands its business apps'
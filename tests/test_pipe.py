@@ -1,5 +1,11 @@
+import os
+import spacy
+import srsly
+from spacy.matcher import PhraseMatcher
 from excelcy import ExcelCy
-from excelcy.pipe import MatcherPipe
+from excelcy.cache import nlp_cache
+from excelcy.pipe import MatcherPipe, EXCELCY_MATCHER
+from excelcy.trie import PhraseTrie
 from excelcy.storage import Config
 from tests.test_base import BaseTestCase
 
@@ -32,3 +38,176 @@ class PipeTestCase(BaseTestCase):
         file_path = self.get_test_tmp_path(fs_path='test_data_01.xlsx')
         excelcy.save_storage(file_path=file_path)
         excelcy.load(file_path=file_path)
+
+    def test_matcher_phrases(self):
+        """ Test: Matcher with bulk phrases """
+
+        excelcy = ExcelCy()
+        excelcy.storage.config = Config(nlp_base='en_core_web_sm')
+        nlp = excelcy.create_nlp()
+        pipe = MatcherPipe(nlp=nlp)
+        pipe.add_phrases(values=['Android Pay', 'Google Maps'], entity='PRODUCT')
+        nlp.add_pipe(pipe)
+        doc = nlp('Google Maps and Android Pay')
+        assert [(ent.text, ent.label_) for ent in doc.ents] == [('Google Maps', 'PRODUCT'), ('Android Pay', 'PRODUCT')]
+
+    def test_matcher_regex(self):
+        """ Test: Matcher with multi tokens regex """
+
+        excelcy = ExcelCy()
+        excelcy.storage.config = Config(nlp_base='en_core_web_sm')
+        nlp = excelcy.create_nlp()
+        patterns = [
+            {'kind': 'regex', 'value': r'\$\d+ million', 'entity': 'MONEY'},
+            {'kind': 'regex', 'value': 'Uber?', 'entity': 'ORG'}
+        ]
+        nlp.add_pipe(MatcherPipe(nlp=nlp, patterns=patterns, regex_mode='text'))
+        doc = nlp('Uber blew through $1 million a week')
+        assert [(ent.text, ent.label_) for ent in doc.ents] == [('Uber', 'ORG'), ('$1 million', 'MONEY')]
+
+    def test_matcher_regex_token(self):
+        """ Test: Matcher regex is matched per token, the text after the match is not captured """
+
+        excelcy = ExcelCy()
+        excelcy.storage.config = Config(nlp_base='en_core_web_sm')
+        nlp = excelcy.create_nlp()
+        patterns = [
+            {'kind': 'regex', 'value': 'thatis(.+)', 'entity': 'PRODUCT'},
+            {'kind': 'regex', 'value': r'^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$', 'entity': 'TIME'}
+        ]
+        nlp.add_pipe(MatcherPipe(nlp=nlp, patterns=patterns))
+        doc = nlp('Buy thatisrandom at 10:30 before the shop closes')
+        assert [(ent.text, ent.label_) for ent in doc.ents] == [('thatisrandom', 'PRODUCT'), ('10:30', 'TIME')]
+
+        # text mode starts the match at a token and expands the match inside a token to the token end
+        pipe = MatcherPipe(nlp=nlp, patterns=[{'kind': 'regex', 'value': r'thatis\w{3}', 'entity': 'PRODUCT'}],
+                           regex_mode='text')
+        doc = pipe(nlp.make_doc('Buy thatisrandom, not xthatisrandom'))
+        assert [(ent.text, ent.label_) for ent in doc.ents] == [('thatisrandom', 'PRODUCT')]
+
+    def test_matcher_regex_group(self):
+        """ Test: Matcher regex with backreference is matched with its own group numbers """
+
+        nlp = spacy.blank('en')
+        for regex_mode in ['token', 'text']:
+            pipe = MatcherPipe(nlp=nlp, regex_mode=regex_mode, patterns=[
+                {'kind': 'regex', 'value': r'code(\d+)', 'entity': 'CODE'},
+                {'kind': 'regex', 'value': r'(\w)\1z', 'entity': 'CODE'},
+                {'kind': 'regex', 'value': r'(?P<c>\w)(?P=c)y', 'entity': 'CODE'},
+            ])
+            doc = pipe(nlp.make_doc('code12 aaz abz bby'))
+            assert [ent.text for ent in doc.ents] == ['code12', 'aaz', 'bby']
+
+    def test_matcher_trie(self):
+        """ Test: Matcher with phrase trie """
+
+        excelcy = ExcelCy()
+        excelcy.storage.config = Config(nlp_base='en_core_web_sm')
+        nlp = excelcy.create_nlp()
+        patterns = [
+            {'kind': 'phrase', 'value': 'android pay', 'entity': 'PRODUCT'},
+            {'kind': 'phrase', 'value': 'google', 'entity': 'ORG'},
+            {'kind': 'phrase', 'value': 'google maps', 'entity': 'PRODUCT'}
+        ]
+        pipe = MatcherPipe(nlp=nlp, patterns=patterns, phrase_backend='trie', phrase_attr='LOWER')
+        nlp.add_pipe(pipe)
+        doc = nlp('Google Maps and Android Pay')
+        assert [(ent.text, ent.label_) for ent in doc.ents] == [('Google Maps', 'PRODUCT'), ('Android Pay', 'PRODUCT')]
+
+        # save and memory-map it back
+        file_path = self.get_test_tmp_path(fs_path='test_trie')
+        pipe.phrase_matcher.to_disk(file_path)
+        trie = PhraseTrie(nlp.vocab).from_disk(file_path)
+        assert sorted(trie(doc)) == sorted(pipe.phrase_matcher(doc))
+
+    def test_matcher_trie_pipe(self):
+        """ Test: Phrase trie matches batch of docs the same as PhraseMatcher, the label conflicts are reported """
+
+        nlp = spacy.blank('en')
+        phrases = {'ORG': ['Uber', 'Google', 'Google Maps Inc'], 'PRODUCT': ['Google Maps', 'Uber', 'Android Pay']}
+        matchers = [PhraseMatcher(nlp.vocab), PhraseTrie(nlp.vocab)]
+        for matcher in matchers:
+            for entity, values in phrases.items():
+                matcher.add(entity, None, *nlp.tokenizer.pipe(values))
+        texts = ['Uber and Google Maps', '', 'Google Maps Inc owns Android Pay', 'Uber Uber', 'no phrase here']
+        docs = [nlp.make_doc(text) for text in texts]
+        expected = [sorted(matchers[0](doc)) for doc in docs]
+        assert [sorted(matches) for _, matches in matchers[1].pipe(docs, batch_size=2, return_matches=True)] == expected
+        assert [sorted(matchers[1](doc)) for doc in docs] == expected
+        assert matchers[1].conflicts == [('Uber', ['ORG', 'PRODUCT'])]
+
+    def test_prepare_bulk(self):
+        """ Test: prepare sheet phrases are added to the phrase matcher once per entity """
+
+        class CountingMatcher(object):
+            def __init__(self, matcher):
+                self.matcher, self.added = matcher, []
+
+            def add(self, key, *args):
+                self.added.append(key)
+                return self.matcher.add(key, *args)
+
+            def __call__(self, doc):
+                return self.matcher(doc)
+
+            def __getattr__(self, name):
+                return getattr(self.matcher, name)
+
+        excelcy = ExcelCy()
+        excelcy.storage.config = Config(nlp_base='en_core_web_sm')
+        pipe = MatcherPipe(nlp=excelcy.nlp)
+        pipe.phrase_matcher = CountingMatcher(matcher=pipe.phrase_matcher)
+        excelcy.nlp.add_pipe(pipe)
+        for value, entity in [('Uber', 'ORG'), ('Google Maps', 'PRODUCT'), ('Lyft', 'ORG'), ('Android Pay', 'PRODUCT')]:
+            excelcy.storage.prepare.add(kind='phrase', value=value, entity=entity)
+        excelcy.storage.prepare.add(kind='regex', value=r'Goo\w+', entity='ORG')
+        excelcy.storage.train.add(text='Lyft and Google Maps on Android Pay')
+        excelcy.prepare()
+        assert pipe.phrase_matcher.added == ['ORG', 'PRODUCT']
+        golds = [(gold.subtext, gold.entity) for train in excelcy.storage.train.items.values()
+                 for gold in train.items.values()]
+        assert golds == [('Lyft', 'ORG'), ('Google Maps', 'PRODUCT'), ('Android Pay', 'PRODUCT')]
+
+    def test_matcher_save(self):
+        """ Test: save and load the matcher with the model """
+
+        excelcy = ExcelCy()
+        excelcy.storage.base_path = self.test_data_path
+        excelcy.storage.config = Config(nlp_base='en_core_web_sm', nlp_keep_matcher=True)
+        excelcy.storage.prepare.add(kind='phrase', value='thisisrandom', entity='PRODUCT')
+        excelcy.storage.prepare.add(kind='regex', value='thatis(.+)', entity='PRODUCT')
+        excelcy.prepare()
+        file_path = self.get_test_tmp_path(fs_path='test_matcher_save')
+        excelcy.save_nlp(file_path=file_path)
+        nlp = spacy.load(file_path)
+        assert EXCELCY_MATCHER in nlp.pipe_names
+        doc = nlp('thisisrandom thatisrandom')
+        assert doc.ents[0].label_ == 'PRODUCT' and doc.ents[1].label_ == 'PRODUCT'
+
+        # bytes as well
+        pipe = MatcherPipe(nlp=nlp).from_bytes(nlp.get_pipe(EXCELCY_MATCHER).to_bytes())
+        assert [ent.label_ for ent in pipe(nlp.make_doc('thisisrandom thatisrandom')).ents] == ['PRODUCT', 'PRODUCT']
+
+        # the phrases are saved as the text per entity, not the spaCy internals
+        cfg = srsly.read_json(os.path.join(file_path, EXCELCY_MATCHER, 'cfg.json'))
+        assert cfg['regex_patterns'] == {'PRODUCT': ['thatis(.+)']}
+        phrases = srsly.read_msgpack(os.path.join(file_path, EXCELCY_MATCHER, 'phrases.msgpack'))
+        assert phrases == {'PRODUCT': ['thisisrandom']}
+        for backend in ['matcher', 'trie']:
+            pipe = MatcherPipe(nlp=nlp, patterns=[{'kind': 'phrase', 'value': 'Google Maps', 'entity': 'PRODUCT'}],
+                               phrase_backend=backend, phrase_attr='LOWER')
+            pipe = MatcherPipe(nlp=nlp).from_bytes(pipe.to_bytes())
+            assert pipe.phrase_backend == backend and pipe.phrase_patterns == {'PRODUCT': {'Google Maps': True}}
+            assert [ent.text for ent in pipe(nlp.make_doc('open google maps')).ents] == ['google maps']
+
+        # prepare again on the saved model, the matcher from the model cache is copied with its patterns
+        excelcy = ExcelCy()
+        excelcy.storage.base_path = self.test_data_path
+        excelcy.storage.config = Config(nlp_base=file_path, nlp_name='test_matcher_save_none')
+        excelcy.storage.prepare.add(kind='phrase', value='Google Maps', entity='PRODUCT')
+        excelcy.storage.train.add(text='thisisrandom thatisrandom on Google Maps')
+        excelcy.prepare()
+        golds = [(gold.subtext, gold.entity) for train in excelcy.storage.train.items.values()
+                 for gold in train.items.values()]
+        assert golds == [('thisisrandom', 'PRODUCT'), ('thatisrandom', 'PRODUCT'), ('Google Maps', 'PRODUCT')]
+        assert excelcy.nlp.get_pipe(EXCELCY_MATCHER) is not nlp_cache.load(name=file_path).get_pipe(EXCELCY_MATCHER)
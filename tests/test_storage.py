@@ -1,4 +1,10 @@
-from excelcy.storage import Storage
+import copy
+import subprocess
+import sys
+from collections import OrderedDict as odict
+import yaml
+from excelcy import utils
+from excelcy.storage import Storage, ColumnarTrains
 from tests.test_base import BaseTestCase
 
 
@@ -22,3 +28,122 @@ class StorageTestCase(BaseTestCase):
         storage.load(file_path=tmp_path)
         data2 = self.extract_storage(storage=storage)
         assert data == data2
+
+    def test_yaml_dump(self):
+        """ Test: YAML storage is dumped the same as with the full PyYAML dumper, tuple is dumped as list """
+        class LegacyDumper(yaml.Dumper):
+            pass
+
+        def represent_odict(dumper, data):
+            value = [(dumper.represent_data(key), dumper.represent_data(val)) for key, val in data.items()]
+            return yaml.nodes.MappingNode(u'tag:yaml.org,2002:map', value)
+
+        LegacyDumper.add_representer(odict, represent_odict)
+        for fs_path in ['test_data_01.xlsx', 'test_data_03.xlsx', 'test_data_04.xlsx']:
+            storage = Storage()
+            storage.load(file_path=self.get_test_data_path(fs_path=fs_path))
+            data = storage.as_dict()
+            assert yaml.dump(data, Dumper=utils._yaml_dumper(), default_flow_style=False) == \
+                yaml.dump(data, Dumper=LegacyDumper, default_flow_style=False)
+
+        tmp_path = self.get_test_tmp_path(fs_path='test_yaml_dump.yml')
+        utils.yaml_save(data=odict([('offset', (1, 2))]), file_path=tmp_path)
+        assert utils.yaml_load(file_path=tmp_path) == odict([('offset', [1, 2])])
+
+    def test_load_save_msgpack(self):
+        """ Test: binary storage has the same data as XLSX, for both train backends """
+        storage = Storage()
+        storage.load(file_path=self.get_test_data_path(fs_path='test_data_04.xlsx'))
+        train = list(storage.train.items.values())[0]
+        train.source, train.enabled, train.notes = '1', False, 'not reviewed'
+        gold = list(list(storage.train.items.values())[1].items.values())[0]
+        gold.enabled, gold.notes = False, 'wrong entity'
+        data = storage.as_dict()
+        tmp_path = self.get_test_tmp_path(fs_path='test_data_04.msgpack')
+        storage.save(file_path=tmp_path)
+        storage.load(file_path=tmp_path)
+        assert storage.as_dict() == data
+        storage.config.train_backend = 'columnar'
+        storage.save(file_path=tmp_path)
+        storage.load(file_path=tmp_path)
+        assert isinstance(storage.train, ColumnarTrains)
+        items = list(storage.as_dict()['train']['items'].values())
+        assert (items[0]['enabled'], items[0]['notes']) == (False, 'not reviewed')
+        assert [(gold['enabled'], gold['notes']) for gold in items[1]['items'].values()][0] == (False, 'wrong entity')
+        data = self.extract_storage(storage=storage)
+        # only train, e.g. export_train
+        storage.save(file_path=tmp_path, kind=['train'])
+        storage = Storage()
+        storage.load(file_path=tmp_path)
+        assert self.extract_storage(storage=storage)['train'] == data['train']
+
+    def test_load_save_columnar(self):
+        storage = Storage()
+        storage.load(file_path=self.get_test_data_path(fs_path='test_data_03.xlsx'))
+        data = self.extract_storage(storage=storage)
+        data['config']['train_backend'] = 'columnar'
+        train = list(data['train']['items'].values())[0]
+        train['source'], train['enabled'], train['notes'] = '1', False, 'not reviewed'
+        gold = list(list(data['train']['items'].values())[1]['items'].values())[0]
+        gold['enabled'], gold['notes'] = False, 'wrong entity'
+        storage.parse(data=data)
+        assert isinstance(storage.train, ColumnarTrains)
+        assert self.extract_storage(storage=storage) == data
+        for fs_path in ['test_data_03_columnar.xlsx', 'test_data_03_columnar.yml']:
+            tmp_path = self.get_test_tmp_path(fs_path=fs_path)
+            storage.save(file_path=tmp_path)
+            storage.load(file_path=tmp_path)
+            assert isinstance(storage.train, ColumnarTrains)
+            assert self.extract_storage(storage=storage) == data
+
+    def test_parse_no_mutation(self):
+        """ Test: parse builds the storage without modifying the given data """
+        storage = Storage()
+        storage.load(file_path=self.get_test_data_path(fs_path='test_data_03.xlsx'))
+        data = storage.as_dict()
+        data['phase'] = odict(items=odict())
+        data['phase']['items']['1'] = odict([('idx', '1'), ('fn', 'save_nlp'), ('args', odict(file_path='[tmp]/nlp'))])
+        expected = copy.deepcopy(data)
+        storage.parse(data=data)
+        storage.phase.items['1'].args['file_path'] = 'changed'
+        storage.train.add_gold(train_idx=list(storage.train.items.keys())[0], subtext='x', entity='X')
+        storage.train.add(text='Added text')
+        assert data == expected
+        assert storage.phase.items['1'].args['file_path'] != '[tmp]/nlp'
+
+    def test_load_xlsx_train(self):
+        """ Test: train sheet is loaded in single pass, with idx assigned to the rows without idx """
+        from excelcy import utils
+        tmp_path = self.get_test_tmp_path(fs_path='test_load_xlsx_train.xlsx')
+        utils.excel_save(sheets={
+            'train': [
+                ['idx', 'text', 'subtext', 'entity'],
+                ['', 'Uber blew through $1 million a week', '', ''],
+                ['', '', 'Uber', 'ORG'],
+                ['', '', '$1 million', 'MONEY'],
+                ['', 'Android Pay expands to Canada', '', ''],
+                ['', '', 'Canada', 'GPE'],
+                ['7', 'Spotify steps up Asia expansion', '', ''],
+                ['7.1', '', 'Spotify', 'ORG'],
+            ],
+            'config': [['name', 'value'], ['nlp_base', 'en_core_web_sm']]
+        }, file_path=tmp_path)
+        storage = Storage()
+        storage.load(file_path=tmp_path)
+        assert list(storage.train.items.keys()) == ['0', '1', '7']
+        assert list(storage.train.items['0'].items.keys()) == ['0.0', '0.1']
+        assert storage.train.items['1'].items['1.0'].subtext == 'Canada'
+        assert storage.train.items['7'].items['7.1'].entity == 'ORG'
+        assert storage.config.nlp_base == 'en_core_web_sm'
+
+    def test_load_save_no_spacy(self):
+        """ Test: storage only load and save does not import spaCy, in fresh interpreter """
+        code = '\n'.join([
+            'import sys',
+            'from excelcy import ExcelCy',
+            'excelcy = ExcelCy()',
+            'excelcy.load(file_path=%r)' % self.get_test_data_path(fs_path='test_data_03.xlsx'),
+            'excelcy.save_storage(file_path=%r)' % self.get_test_tmp_path(fs_path='test_data_03_no_spacy.yml'),
+            'assert "spacy" not in sys.modules, "spacy is imported"'
+        ])
+        subprocess.run([sys.executable, '-c', code], check=True)